@@ -1,21 +1,21 @@
 # import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-from scipy.stats import norm
 from components.layout import configure_page_settings
 from components.tables import stylized_table
+from utils.data_access import list_gages, load_gage
+from utils.frequency import plotting_positions
+from utils.stac_data import add_item_links, get_stac_url
 
 def app():
     configure_page_settings("Gage Viewer")
 
     st.markdown("## Weibull Plotter for Gage Results")
 
-    df = st.gages
-
     col1, col2 = st.columns(2)
 
     with col1:
-        gage_id = st.selectbox("Search for results by Gage", ["None", *df["gage"].unique()])
+        gage_id = st.selectbox("Search for results by Gage", ["None", *list_gages()])
 
         variable = st.selectbox("Select Water Surface Elevation or Flow", ["Flow", "WSE"])
 
@@ -25,7 +25,8 @@ def app():
             value, time, plot_label = "max_wse_value", "max_wse_time", "Water Surface Elevation(ft)"
 
         if gage_id != "None":
-            df = df[df["gage"].str.contains(gage_id, case=False, na=False)]
+            df = plotting_positions(load_gage(gage_id, variable), value)
+            df = add_item_links(df, get_stac_url())
             df["rank"] = df[value].rank(ascending=False)
             # stylized_table(df[["ID", value, "rank", time, "Link"]].sort_values(by="rank", ascending=True))
             stylized_table(df[["ID", value, "rank", "Link"]].sort_values(by="rank", ascending=True))
@@ -35,19 +36,11 @@ def app():
         fig = go.Figure()
 
         if gage_id != "None":
-            for realization in df["realization"].unique():
-                realization_df = df[df["realization"] == realization]
-                realization_df = realization_df.sort_values(by=value, ascending=False)
-                realization_df["rank"] = realization_df[value].rank(ascending=False)
-                realization_df["weibull_position"] = realization_df["rank"] / (len(realization_df) + 1)
-
-                rank = realization_df["rank"].values.astype(int)
-                pp = [i / (len(rank) + 1) for i in rank]
-                z_scores = [norm.ppf(1 - p) for p in pp] 
-
+            # plotting positions and z-scores were computed for all realizations by plotting_positions
+            for realization, realization_df in df.groupby("realization", sort=False):
                 fig.add_trace(
                     go.Scatter(
-                        x=z_scores,
+                        x=realization_df["z_score"],
                         y=realization_df[value],
                         mode="markers",
                         name=f"Realization {realization}",
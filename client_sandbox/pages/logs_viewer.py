@@ -0,0 +1,59 @@
+import datetime
+import os
+
+import streamlit as st
+from components.layout import configure_page_settings
+from utils.log_store import LogIngester, read_log_table
+from utils.logger import find_huey_log
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+# Parts written by successive ingests before they are merged into one
+MAX_LOG_PARTS = 20
+
+
+@st.cache_resource(show_spinner=False)
+def log_ingester(log_file: str) -> LogIngester:
+    """One ingester per log file, shared by all sessions, its table next to the log."""
+    return LogIngester(log_file, os.path.join(os.path.dirname(log_file), "log-table"))
+
+
+def app():
+    configure_page_settings("Log Viewer")
+
+    st.markdown("## Log Viewer")
+
+    log_dir = st.text_input("Working directory", value=st.session_state.get("log_dir", ""))
+    st.session_state.log_dir = log_dir
+    log_file = find_huey_log(log_dir)
+    if log_file is None:
+        return
+
+    # only the lines appended since the last rerun are parsed
+    ingester = log_ingester(log_file)
+    ingested = ingester.ingest()
+    if len(ingester.parts()) > MAX_LOG_PARTS:
+        ingester.compact()
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        levels = st.multiselect("Levels", LOG_LEVELS)
+    with col2:
+        function_names = read_log_table(ingester.table_dir, columns=["function_name"])["function_name"]
+        functions = st.multiselect("Functions", sorted(function_names.dropna().unique()))
+    with col3:
+        today = datetime.date.today()
+        dates = st.date_input("Date range", value=(today - datetime.timedelta(days=7), today))
+
+    start = end = None
+    if len(dates) == 2:
+        start = datetime.datetime.combine(dates[0], datetime.time.min)
+        end = datetime.datetime.combine(dates[1], datetime.time.max)
+
+    df = read_log_table(ingester.table_dir, levels=levels, functions=functions, start=start, end=end)
+    st.caption(f"{ingested} new log lines ingested, {len(df)} entries match")
+    st.dataframe(df.sort_values("timestamp", ascending=False), use_container_width=True, hide_index=True)
+
+
+if __name__ == "__main__":
+    app()
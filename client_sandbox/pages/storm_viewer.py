@@ -1,17 +1,47 @@
-import os
-
 import folium
-import geopandas as gpd
+import pandas as pd
+import requests
 import streamlit as st
 from components.layout import configure_page_settings
 from components.tables import stylized_table
-from shapely import wkt
-from shapely.geometry import Point
+from utils.data_access import storm_index
+from utils.stac_data import add_item_links, get_stac_url
 from streamlit_folium import st_folium
 
 
-def text_to_point(point_str):
-    return wkt.loads(point_str)
+def storm_centers(df: pd.DataFrame, center: str) -> pd.DataFrame:
+    """
+    ID, lat and lon of a storm center column, from the {center}_lat/_lon columns written by the ETL, or parsed
+    (vectorized) from the "POINT(lat lon)" text for older summaries.
+    """
+    if f"{center}_lat" in df.columns:
+        lat, lon = df[f"{center}_lat"], df[f"{center}_lon"]
+    else:
+        coords = df[center].astype(str).str.extract(r"POINT\s*\(\s*(\S+)\s+(\S+)\s*\)")
+        lat, lon = pd.to_numeric(coords[0], errors="coerce"), pd.to_numeric(coords[1], errors="coerce")
+    return pd.DataFrame({"ID": df["ID"].astype(str), "lat": lat.astype("float64"), "lon": lon.astype("float64")})
+
+
+@st.cache_data(show_spinner=False)
+def centers_geojson(centers: pd.DataFrame, label: str) -> dict:
+    """Single GeoJSON layer for a set of storm centers, cached across reruns for the same rows."""
+    centers = centers.dropna()
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"popup": f"{label}: {item_id}"},
+        }
+        for item_id, lat, lon in zip(centers["ID"], centers["lat"], centers["lon"])
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_geojson(url: str) -> dict:
+    response = requests.get(url)
+    response.raise_for_status()
+    return response.json()
 
 
 def app():
@@ -19,23 +49,15 @@ def app():
 
     st.markdown("## Storm Viewer")
 
-    df = st.storms.rename(
-        columns={
-            "block_group": "Block",
-            "historic_storm_date": "Date",
-            "historic_storm_season": "Season",
-            "historic_storm_max_precip_inches": "Max Precip (in)",
-            "realization": "Realization",
-            "date": "Date",
-        }
-    )
+    stac_url = get_stac_url()
+    index = storm_index()
 
     search_col1, search_col2 = st.columns(2)
 
     with search_col1:
         realization = st.number_input("Search by Realization", min_value=1, max_value=5, step=1)
         search_block = st.number_input("Search by Block Group", min_value=0, step=1)
-        search_id = st.text_input("Search by ID")
+        search_id = st.text_input("Search by ID prefix")
 
     with search_col2:
         search_precip_inches = st.number_input("Search by Max Precipitation (inches)", min_value=0.0, step=0.1)
@@ -45,24 +67,31 @@ def app():
         if enable_date_search:
             search_storm_date = st.date_input("Search by Storm Date")
 
-    if search_block:
-        df = df[df["Block"] == search_block]
-    if realization != 1:
-        df = df[df["Realization"] == realization]
-    if search_id:
-        df = df[df["ID"].str.contains(search_id, case=False, na=False)]
-    if search_precip_inches:
-        df = df[df["Max Precip (in)"] >= search_precip_inches]
-    if search_storm_date:
-        df = df[df["Date"].str.contains(search_storm_date.strftime("%Y-%m-%d"), case=False, na=False)]
-    if storm_season != "All":
-        df = df[df["Season"].str.contains(storm_season, case=False, na=False)]
+    storms = index.search(
+        realization=realization if realization != 1 else None,
+        block_group=search_block,
+        id_prefix=search_id,
+        min_precip=search_precip_inches,
+        storm_date=search_storm_date,
+        season=storm_season if storm_season != "All" else None,
+    )
+
+    df = storms.rename(
+        columns={
+            "block_group": "Block",
+            "historic_storm_date": "Date",
+            "historic_storm_season": "Season",
+            "historic_storm_max_precip_inches": "Max Precip (in)",
+            "realization": "Realization",
+            "date": "Date",
+        }
+    )
 
     col1, col2 = st.columns([2, 1])
 
     with col1:
         stylized_table(
-            df[
+            add_item_links(df, stac_url, realization_column="Realization")[
                 [
                     "ID",
                     # "Realization",
@@ -76,51 +105,25 @@ def app():
         )
 
     with col2:
+        m = folium.Map(location=[37.75153, -80.94911], zoom_start=6)
 
         try:
-            df["geometry"] = df["historic_storm_center"].apply(text_to_point)
-            gdf = gpd.GeoDataFrame(df, geometry="geometry")
-        except Exception as e:
-            st.write(f"Error creating GeoDataFrame: {e}")
-            return
-
-        try:
-            df["geometry2"] = st.storms["SST_storm_center"].apply(text_to_point)
-            gdf2 = gpd.GeoDataFrame(df[["ID"]], geometry=df["geometry2"], crs=st.proj1)
+            folium.GeoJson(fetch_geojson(f"{stac_url}/collections/Kanawha-R01/items/E002044")).add_to(m)
         except Exception as e:
-            st.write(f"Error creating secondary GeoDataFrame: {e}")
-            gdf2 = None
-
-        m = folium.Map(location=[37.75153, -80.94911], zoom_start=6)
-
-        folium.GeoJson(f"{st.stac_url}/collections/Kanawha-R01/items/E002044").add_to(m)
-
-        # historic_storm_center
-        for idx, row in gdf.iterrows():
-            if isinstance(row.geometry, Point):
-                folium.CircleMarker(
-                    location=[row.geometry.y, row.geometry.x],
-                    radius=5,
-                    color="blue",
-                    fill=True,
-                    fill_color="blue",
-                    popup=f"Historic Center: {row['ID']}",
-                ).add_to(m)
-
-        # SST_storm_center
-        if gdf2 is not None:
-            for idx, row in gdf2.iterrows():
-                if isinstance(row.geometry, Point):
-                    folium.CircleMarker(
-                        location=[row.geometry.y, row.geometry.x],
-                        radius=5,
-                        color="red",
-                        fill=True,
-                        fill_color="red",
-                        popup=f"SST Center: {row['ID']}",
-                    ).add_to(m)
-
-        st_folium(m, width=350, height=500)
+            st.write(f"Error fetching basin geometry: {e}")
+
+        for center, label, color in (
+            ("historic_storm_center", "Historic Center", "blue"),
+            ("SST_storm_center", "SST Center", "red"),
+        ):
+            folium.GeoJson(
+                centers_geojson(storm_centers(df, center), label),
+                marker=folium.CircleMarker(radius=5, color=color, fill=True, fill_color=color),
+                popup=folium.GeoJsonPopup(fields=["popup"], labels=False),
+            ).add_to(m)
+
+        # the map is display only, don't rerun the page on map interactions
+        st_folium(m, width=350, height=500, returned_objects=[])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from utils.storm_search import StormIndex
+from utils.table_cache import table_cache
+
+DATA_SUMMARY_PREFIX = "s3://kanawha-pilot/stac/Kanawha-0505/data-summary"
+GAGES_DATA = f"{DATA_SUMMARY_PREFIX}/gages"
+STORMS_DATA = f"{DATA_SUMMARY_PREFIX}/storms"
+COMPUTATION_DATA = f"{DATA_SUMMARY_PREFIX}/computation"
+
+# Matches the hive partitioning written by etl/stac_to_pqs.py
+PARTITIONING = ds.partitioning(pa.schema([("realization", pa.int64())]), flavor="hive")
+
+GAGE_VARIABLES = {"Flow": "flow", "WSE": "wse"}
+
+# Gage results kept in the table cache, the least recently viewed are dropped beyond this
+GAGE_CACHE_SIZE = 64
+
+
+def open_dataset(uri: str) -> ds.Dataset:
+    """Open a partitioned summary dataset; only the parquet footers are read."""
+    return ds.dataset(uri, format="parquet", partitioning=PARTITIONING)
+
+
+def read_table(uri: str, columns: list = None, filter: pc.Expression = None) -> pd.DataFrame:
+    """Read the row groups matching filter (pruned with the parquet statistics) and only the requested columns."""
+    return open_dataset(uri).to_table(columns=columns, filter=filter).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def cached_table(uri: str, columns: list = None, filter: pc.Expression = None) -> pd.DataFrame:
+    """Read a table through the process-wide table cache; filtered reads are not cached."""
+    if filter is not None:
+        return read_table(uri, columns=columns, filter=filter)
+    return table_cache.get(uri, lambda: read_table(uri, columns=columns), columns=columns)
+
+
+def list_gages() -> list:
+    """
+    Sorted unique gage names, reading only the gage column once per version of the dataset (kept in the table
+    cache).
+    """
+
+    def read_gage_names():
+        gages = open_dataset(GAGES_DATA).to_table(columns=["gage"]).column("gage")
+        return sorted(pc.unique(gages).to_pylist())
+
+    return table_cache.get(GAGES_DATA, read_gage_names, key=("gage_names",))
+
+
+def load_gage(gage_id: str, variable: str = "Flow", realizations: list = None) -> pd.DataFrame:
+    """
+    Load the results of a single gage for one variable ("Flow" or "WSE").
+
+    Returns the ID, realization, gage and max_{flow,wse}_{value,time} columns of the rows matching gage_id exactly.
+    The gages dataset is sorted by gage, so only the row groups containing it are read, once per gage and variable
+    while the dataset is unchanged (the result is kept in the table cache, for the GAGE_CACHE_SIZE most recently
+    viewed gages).
+    """
+    variable = GAGE_VARIABLES[variable]
+    filter = ds.field("gage") == gage_id
+    if realizations:
+        filter &= ds.field("realization").isin(realizations)
+    columns = ["ID", "realization", "gage", f"max_{variable}_value", f"max_{variable}_time"]
+    return table_cache.get(
+        GAGES_DATA,
+        lambda: read_table(GAGES_DATA, columns=columns, filter=filter),
+        columns=columns,
+        key=("gage", gage_id, tuple(realizations or ())),
+        max_entries=GAGE_CACHE_SIZE,
+    )
+
+
+def load_storms(columns: list = None, filter: pc.Expression = None) -> pd.DataFrame:
+    return cached_table(STORMS_DATA, columns=columns, filter=filter)
+
+
+def storm_index() -> StormIndex:
+    """
+    StormIndex over the (cached) storms table, built once per version of the table and shared by all sessions. The
+    index is built from the cached table (whose Arrow columns it shares) rather than a second read of it.
+    """
+    return table_cache.get(STORMS_DATA, lambda: StormIndex(load_storms()), key=("storm_index",))
+
+
+def load_computation(columns: list = None, filter: pc.Expression = None) -> pd.DataFrame:
+    return cached_table(COMPUTATION_DATA, columns=columns, filter=filter)
@@ -0,0 +1,28 @@
+import pandas as pd
+from scipy.special import ndtri
+
+
+def plotting_positions(df: pd.DataFrame, value: str, group: str = "realization") -> pd.DataFrame:
+    """
+    Rank the values of each group (largest first) and compute their Weibull plotting positions and standard normal
+    z-scores in one grouped pass.
+
+    Adds the columns:
+        realization_rank: rank of the value within its group (ties share the average rank)
+        weibull_position: exceedance probability rank / (n + 1), n being the number of values in the group
+        z_score: standard normal quantile of the non-exceedance probability 1 - weibull_position
+
+    Returns a copy sorted by group and descending value.
+    """
+    df = df.sort_values([group, value], ascending=[True, False])
+    values = df[value].astype("float64")
+    grouped = values.groupby(df[group], sort=False)
+
+    rank = grouped.rank(ascending=False).to_numpy()
+    n = grouped.transform("count").to_numpy()
+    weibull_position = rank / (n + 1)
+
+    df["realization_rank"] = rank
+    df["weibull_position"] = weibull_position
+    df["z_score"] = ndtri(1 - weibull_position)
+    return df
@@ -0,0 +1,264 @@
+import ast
+import datetime
+import json
+import os
+import threading
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# Lines parsed per parquet part written by LogIngester.ingest
+INGEST_BATCH_LINES = 50_000
+
+OFFSET_FILE = "_offset.json"
+# Merged part and record of the parts it supersedes, while LogIngester.compact replaces them
+COMPACTED_FILE = "_compacted.parquet"
+COMPACTION_FILE = "_compaction.json"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+LOG_SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("ms")),
+        ("level", pa.dictionary(pa.int8(), pa.string())),
+        ("type", pa.dictionary(pa.int8(), pa.string())),
+        ("logger_name", pa.string()),
+        ("function_name", pa.string()),
+        ("line_number", pa.int64()),
+        ("filename", pa.string()),
+        ("message", pa.string()),
+        # the structured msg of records logged with utils.logger.log, as JSON
+        ("fields", pa.string()),
+        ("error", pa.string()),
+        ("traceback", pa.string()),
+    ]
+)
+
+
+def structured_msg(msg):
+    """
+    The {"msg": ..., "error": ..., "traceback": ...} dict of a record logged with utils.logger.log, whose msg is the
+    repr of that dict, parsed as JSON or as a Python literal (never evaluated). None for any other msg.
+    """
+    if not isinstance(msg, str) or not msg.startswith("{"):
+        return None
+    try:
+        parsed = loads(msg)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(msg)
+        except (SyntaxError, ValueError, MemoryError, RecursionError):
+            return None
+    return parsed if isinstance(parsed, dict) and "msg" in parsed else None
+
+
+def parse_msg(msg) -> tuple:
+    """Split the msg of a log entry into (message, fields as JSON, error, traceback)."""
+    parsed = structured_msg(msg)
+    if parsed is None or not isinstance(parsed["msg"], dict):
+        return (None if msg is None else str(msg)), None, None, None
+    return None, json.dumps(parsed["msg"], default=str), parsed.get("error"), parsed.get("traceback")
+
+
+def log_lines_to_table(lines: list) -> pa.Table:
+    """Parse JSON log lines (as written by utils.logger.LogFormatter) into a LOG_SCHEMA table, skipping bad lines."""
+    columns = {field.name: [] for field in LOG_SCHEMA}
+    for line in lines:
+        try:
+            entry = loads(line)
+        except ValueError:
+            continue
+        message, fields, error, trace = parse_msg(entry.get("msg"))
+        columns["timestamp"].append(entry.get("timestamp"))
+        columns["level"].append(entry.get("level"))
+        columns["type"].append(entry.get("@type"))
+        columns["logger_name"].append(entry.get("logger_name"))
+        columns["function_name"].append(entry.get("function_name"))
+        columns["line_number"].append(entry.get("line_number"))
+        columns["filename"].append(entry.get("filename"))
+        columns["message"].append(message)
+        columns["fields"].append(fields)
+        columns["error"].append(entry.get("error") or error)
+        columns["traceback"].append(entry.get("traceback") or trace)
+    # LogFormatter timestamps ("2024-01-01 00:00:00,123"), parsed for the whole batch at once
+    columns["timestamp"] = pd.to_datetime(columns["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+    return pa.table(columns, schema=LOG_SCHEMA)
+
+
+def _read_compaction(table_dir: str) -> dict:
+    try:
+        with open(os.path.join(table_dir, COMPACTION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def table_parts(table_dir: str) -> list:
+    """
+    The parquet files of a log table. While a compaction is being applied (see LogIngester.compact), the merged part
+    stands for the parts it supersedes, so readers see every row exactly once.
+    """
+    names = [name for name in os.listdir(table_dir) if name.startswith("part-")]
+    compaction = _read_compaction(table_dir)
+    if compaction is not None:
+        superseded = compaction["superseded"]
+        names = [name for name in names if name not in superseded]
+        # the merged part is renamed to the first part it supersedes
+        merged = COMPACTED_FILE if os.path.exists(os.path.join(table_dir, COMPACTED_FILE)) else superseded[0]
+        names.append(merged)
+    return sorted(os.path.join(table_dir, name) for name in names)
+
+
+class LogIngester:
+    """
+    Incrementally ingest a JSON-lines log file into a parquet log table (a directory of parts).
+
+    The byte offset of the last complete line ingested is kept in the table directory, so each `ingest` only reads
+    the lines appended since the previous one. A partial last line, still being written, is left for the next call.
+
+    A rotated or truncated file is read from the start as a new generation of the log: parts are named by generation
+    and offset, so the parts of earlier generations are kept (and still sort first).
+
+    An ingester can be shared between threads (e.g. Streamlit sessions), its ingests and compactions run one at a time.
+    """
+
+    def __init__(self, log_file: str, table_dir: str, batch_lines: int = INGEST_BATCH_LINES):
+        self.log_file = log_file
+        self.table_dir = table_dir
+        self.batch_lines = batch_lines
+        self._lock = threading.Lock()
+        os.makedirs(table_dir, exist_ok=True)
+
+    def _read_offset(self, stat: os.stat_result) -> tuple:
+        """(generation, offset) of the log file to ingest from."""
+        try:
+            with open(os.path.join(self.table_dir, OFFSET_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self._last_generation() + 1, 0
+        generation = state.get("generation", 0)
+        if state.get("inode") != stat.st_ino or state.get("offset", 0) > stat.st_size:
+            # rotated or truncated
+            return generation + 1, 0
+        return generation, state["offset"]
+
+    def _write_offset(self, stat: os.stat_result, generation: int, offset: int):
+        path = os.path.join(self.table_dir, OFFSET_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"log_file": self.log_file, "inode": stat.st_ino, "generation": generation, "offset": offset}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _last_generation(self) -> int:
+        """Latest generation with parts in the table (-1 if none), for tables whose offset file was lost."""
+        generations = []
+        for part in os.listdir(self.table_dir):
+            name = part.split("-")
+            if len(name) == 3 and name[1].isdigit():
+                generations.append(int(name[1]))
+        return max(generations, default=-1)
+
+    def _iter_batches(self, offset: int) -> Iterator[tuple]:
+        """Yield (lines, end offset) batches of complete lines from offset."""
+        with open(self.log_file, "rb") as f:
+            f.seek(offset)
+            lines = []
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                lines.append(line)
+                if len(lines) >= self.batch_lines:
+                    yield lines, offset
+                    lines = []
+            if lines:
+                yield lines, offset
+
+    def ingest(self) -> int:
+        """Append the new complete lines of the log file to the table, returning the number of lines read."""
+        with self._lock:
+            stat = os.stat(self.log_file)
+            generation, offset = self._read_offset(stat)
+
+            ingested = 0
+            for lines, end in self._iter_batches(offset):
+                pq.write_table(
+                    log_lines_to_table(lines),
+                    os.path.join(self.table_dir, f"part-{generation:06d}-{offset:015d}.parquet"),
+                    compression="zstd",
+                )
+                self._write_offset(stat, generation, end)
+                ingested += len(lines)
+                offset = end
+            return ingested
+
+    def parts(self) -> list:
+        return table_parts(self.table_dir)
+
+    def compact(self):
+        """
+        Merge the parts written by successive ingests into a single part, one part at a time.
+
+        The merged part is fully written, and the parts it supersedes recorded, before any part is removed: a crash
+        leaves either the old parts or the merged part in place (see table_parts), and the next compaction finishes
+        the one that was interrupted.
+        """
+        with self._lock:
+            self._finish_compaction()
+            parts = self.parts()
+            if len(parts) < 2:
+                return
+            # written under an ignored name, renamed to the first part so later ingests still sort after it
+            merged = os.path.join(self.table_dir, COMPACTED_FILE)
+            with pq.ParquetWriter(merged, LOG_SCHEMA, compression="zstd") as writer:
+                for part in parts:
+                    writer.write_table(pq.read_table(part, schema=LOG_SCHEMA))
+            path = os.path.join(self.table_dir, COMPACTION_FILE)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"superseded": [os.path.basename(part) for part in parts]}, f)
+            os.replace(f"{path}.tmp", path)
+            self._finish_compaction()
+
+    def _finish_compaction(self):
+        """Replace the parts superseded by a recorded compaction with its merged part."""
+        compaction = _read_compaction(self.table_dir)
+        if compaction is None:
+            return
+        first, *rest = compaction["superseded"]
+        for name in rest:
+            try:
+                os.remove(os.path.join(self.table_dir, name))
+            except FileNotFoundError:
+                pass
+        merged = os.path.join(self.table_dir, COMPACTED_FILE)
+        if os.path.exists(merged):
+            os.replace(merged, os.path.join(self.table_dir, first))
+        os.remove(os.path.join(self.table_dir, COMPACTION_FILE))
+
+
+def read_log_table(
+    table_dir: str,
+    levels: list = None,
+    functions: list = None,
+    start: datetime.datetime = None,
+    end: datetime.datetime = None,
+    columns: list = None,
+) -> pd.DataFrame:
+    """Filter the log table by level, function name and time range, reading only the matching rows and columns."""
+    dataset = ds.dataset(table_parts(table_dir), format="parquet", schema=LOG_SCHEMA)
+    filter = None
+    for expression in (
+        ds.field("level").isin(levels) if levels else None,
+        ds.field("function_name").isin(functions) if functions else None,
+        ds.field("timestamp") >= pa.scalar(start, pa.timestamp("ms")) if start else None,
+        ds.field("timestamp") <= pa.scalar(end, pa.timestamp("ms")) if end else None,
+    ):
+        if expression is not None:
+            filter = expression if filter is None else filter & expression
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
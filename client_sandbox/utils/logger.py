@@ -1,35 +1,64 @@
+import atexit
 import glob
 import inspect
+import io
 import json
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
+import time
 import traceback
 from collections import defaultdict
 from typing import Any, Dict
 
 import pandas as pd
 import streamlit as st
+from utils.log_store import structured_msg
+
+try:
+    import orjson
+
+    JSON_ENCODER = "orjson"
+
+    _json_dumps = json.JSONEncoder(check_circular=False, default=str).encode
+
+    def dumps(obj) -> str:
+        try:
+            # non-str (e.g. int) dict keys are written as strings, like json does
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # what orjson can't serialize but json can, e.g. integers over 64 bits
+            return _json_dumps(obj)
+
+except ImportError:
+    JSON_ENCODER = "json"
+    dumps = json.JSONEncoder(check_circular=False, default=str).encode
 
 
 class LogFormatter(logging.Formatter):
-    def __init__(self, log_type: str):
+    """
+    Format records as JSON lines.
+
+    The function name, line number and file are those of the code calling the logger, or `log` (which logs with
+    stacklevel=2), as resolved by the logging module when the record is created: no stack inspection per record.
+    """
+
+    def __init__(self, log_type: str, datefmt: str = None):
+        super().__init__(datefmt=datefmt)
         self.log_type = log_type
 
     def format(self, record):
-        # Get the function name of the caller
-        stack = inspect.stack()
-        # Start from 1 to skip the current frame
-        for frame_info in stack[1:]:
-            if frame_info.function != "log":
-                record.funcName = frame_info.function
-                break
+        return dumps(self.log_entry(record))
 
+    def log_entry(self, record) -> dict:
         log_entry = {
             "@type": self.log_type,
             "timestamp": self.formatTime(record, self.datefmt),
             "level": record.levelname,
-            "msg": record.getMessage(),
+            # dict messages (from `log`) as JSON, parsed by log readers without evaluating them
+            "msg": dumps(record.msg) if isinstance(record.msg, dict) and not record.args else record.getMessage(),
             "logger_name": record.name,
             "function_name": record.funcName,
             "line_number": record.lineno,
@@ -40,30 +69,51 @@ class LogFormatter(logging.Formatter):
 
         if record.exc_info:
             log_entry["error"] = str(record.exc_info[1])
-            log_entry["traceback"] = traceback.format_exc()
+            log_entry["traceback"] = self.formatException(record.exc_info)
 
-        return json.dumps(log_entry)
+        return log_entry
 
 
 def setup_logging(
-    log_type: str, log_level: int = logging.INFO, log_to_file: bool = False, log_file_path: str = "log.json"
+    log_type: str,
+    log_level: int = logging.INFO,
+    log_to_file: bool = False,
+    log_file_path: str = "log.json",
+    non_blocking: bool = False,
 ):
     """
     Sets up logging for the application. Configures log levels for ripple1d and main script.
+
+    With non_blocking=True records are formatted in the logging thread and handed to a queue; a QueueListener thread
+    writes them to the stream (and file), so the caller never waits on I/O. Returns the (started) listener, stopped at
+    exit, or None.
     """
     logger = logging.getLogger()
     logger.setLevel(log_level)
 
     formatter = LogFormatter(log_type)
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-
+    handlers = [logging.StreamHandler()]
     if log_to_file:
-        file_handler = logging.FileHandler(log_file_path)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(logging.FileHandler(log_file_path))
+
+    if not non_blocking:
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+        return None
+
+    # the queue handler formats (the record carries the JSON line, exc_info included), the listener only writes
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.setFormatter(formatter)
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # flush the queue at exit, unless the caller already stopped the listener
+    atexit.register(lambda: listener._thread is not None and listener.stop())
+    logger.addHandler(queue_handler)
+    return listener
 
 
 def log(
@@ -88,7 +138,8 @@ def log(
         if include_traceback:
             log_entry["traceback"] = traceback.format_exc()
 
-    logger.log(level, log_entry)
+    # attribute the record to the caller of log
+    logger.log(level, log_entry, stacklevel=2)
 
 
 def move_existing_logs(log_dir):
@@ -114,12 +165,12 @@ def find_huey_log(log_dir):
 
 
 def read_logs(log_file):
+    """Yield the lines of a log file one at a time (see utils.log_store.LogIngester to ingest large logs)."""
     try:
         with open(log_file, "r") as file:
-            return file.readlines()
+            yield from file
     except Exception as e:
         st.error(f"Failed to read logs: {e}")
-        return []
 
 
 def parse_logs_to_dict(logs: str) -> dict:
@@ -137,29 +188,19 @@ def logs_to_dataframe(log_entries: list, all_columns: bool = True) -> pd.DataFra
     processed_logs = []
 
     for log_entry in log_entries:
-        # If the 'msg' field is a string that looks like a dictionary, convert it
-        if isinstance(log_entry["msg"], str):
-            try:
-                msg_dict = eval(log_entry["msg"])
-                if isinstance(msg_dict, dict) and "msg" in msg_dict:
-                    log_entry.update(msg_dict["msg"])
-
-                    # Check for 'error' and 'traceback' keys and include them
-                    if "error" in msg_dict:
-                        log_entry["error"] = msg_dict["error"]
-                    if "traceback" in msg_dict:
-                        log_entry["traceback"] = msg_dict["traceback"]
-
-                    del log_entry["msg"]
-                else:
-                    log_entry["message"] = log_entry["msg"]
-                    del log_entry["msg"]
-            except (SyntaxError, ValueError):
-                log_entry["message"] = log_entry["msg"]
-                del log_entry["msg"]
+        # If the 'msg' field is the repr of a dictionary logged with `log`, parse it (without evaluating it)
+        msg = log_entry.pop("msg")
+        msg_dict = structured_msg(msg)
+        if msg_dict is not None and isinstance(msg_dict["msg"], dict):
+            log_entry.update(msg_dict["msg"])
+
+            # Check for 'error' and 'traceback' keys and include them
+            if "error" in msg_dict:
+                log_entry["error"] = msg_dict["error"]
+            if "traceback" in msg_dict:
+                log_entry["traceback"] = msg_dict["traceback"]
         else:
-            log_entry["message"] = log_entry["msg"]
-            del log_entry["msg"]
+            log_entry["message"] = msg
 
         processed_logs.append(log_entry)
 
@@ -168,3 +209,45 @@ def logs_to_dataframe(log_entries: list, all_columns: bool = True) -> pd.DataFra
         return df
     else:
         return df.drop(columns=["@type", "level", "link"], errors="ignore")
+
+
+class InspectStackFormatter(LogFormatter):
+    """The previous caller resolution, walking inspect.stack() per record, kept as the benchmark baseline."""
+
+    def format(self, record):
+        for frame_info in inspect.stack()[1:]:
+            if frame_info.function != "log":
+                record.funcName = frame_info.function
+                break
+        return json.dumps(self.log_entry(record))
+
+
+def benchmark(records: int = 2000):
+    """Time the per-record cost of logging (through `log`) with the previous and current formatters."""
+    logger = logging.getLogger("logger_benchmark")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+
+    def run(formatter, handler):
+        handler.setFormatter(formatter)
+        logger.handlers = [handler]
+        start = time.perf_counter()
+        for i in range(records):
+            logger.log(logging.INFO, {"msg": {"record": i, "page": "benchmark"}})
+        return (time.perf_counter() - start) / records * 1e6
+
+    for name, formatter in (
+        ("inspect.stack + json", InspectStackFormatter("benchmark")),
+        (f"record caller + {JSON_ENCODER}", LogFormatter("benchmark")),
+    ):
+        print(f"{name}: {run(formatter, logging.StreamHandler(io.StringIO())):.1f} us/record")
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    listener = logging.handlers.QueueListener(queue_handler.queue, logging.StreamHandler(io.StringIO()))
+    listener.start()
+    print(f"record caller, queued: {run(LogFormatter('benchmark'), queue_handler):.1f} us/record")
+    listener.stop()
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,20 +1,47 @@
+import os
+
 import pandas as pd
 import streamlit as st
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def get_stac_url():
+    return os.getenv("STAC_API_URL")
 
 
-def generate_stac_item_link(base_url, collection_id, item_id):
-    return (
-        f"https://radiantearth.github.io/stac-browser/#/external/{base_url}/collections/{collection_id}/items/{item_id}"
+def stac_item_url(stac_url: str, collection_id, item_id):
+    """
+    STAC browser url of an item. collection_id and item_id are strings, or string Series to build the urls of many
+    items with vectorized string ops.
+    """
+    return f"https://radiantearth.github.io/stac-browser/#/external/{stac_url}/collections/" + (
+        collection_id + "/items/" + item_id
     )
 
 
+def add_item_links(df: pd.DataFrame, stac_url: str, realization_column: str = "realization") -> pd.DataFrame:
+    """
+    Add a Link column with an html link to each row's STAC item, built with vectorized string ops over the
+    realization and ID columns.
+
+    Call it on the rows about to be displayed (after filtering), not on a whole table.
+    """
+    df = df.copy(deep=False)
+    collection_ids = "Kanawha-0505-R" + df[realization_column].astype(str).str.zfill(3)
+    item_urls = stac_item_url(stac_url, collection_ids, df["ID"].astype(str))
+    df["Link"] = '<a href="' + item_urls + '" target="_blank">See in Catalog</a>'
+    return df
+
+
 def fetch_collection_data(collection_id, _progress_bar):
     items = list(st.session_state.stac_client.search(collections=[collection_id]).items())
     item_data = []
     total_items = len(items)
 
     for idx, item in enumerate(items):
-        stac_item_link = f"https://radiantearth.github.io/stac-browser/#/external/{st.session_state.stac_url}/collections/{collection_id}/items/{item.id}"
+        stac_item_link = stac_item_url(st.session_state.stac_url, collection_id, item.id)
 
         event = item.properties.get("event", "N/A")
         block_group = item.properties.get("block_group", "N/A")
@@ -0,0 +1,173 @@
+import datetime
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+MAX_CACHED_QUERIES = 256
+
+
+def query_key(
+    realization=None, block_group=None, id_prefix=None, min_precip=None, storm_date=None, season=None
+) -> tuple:
+    return (realization, block_group, (id_prefix or "").lower(), min_precip, storm_date, (season or "").lower())
+
+
+class StormIndex:
+    """
+    Precomputed indexes over the storms summary table backing the storm viewer filters.
+
+    Built once per table: categorical codes for season and realization, a sorted index on max precipitation, a
+    parsed (day resolution) storm date column and a sorted, lower-cased ID index for prefix search. The matching row
+    positions of `search` are cached by query, so repeating a filter combination costs a dict lookup and a take.
+
+    Safe to share between sessions (see table_cache): the cache is guarded by a lock and each search returns a new
+    DataFrame.
+    """
+
+    def __init__(self, storms: pd.DataFrame):
+        self.storms = storms.reset_index(drop=True)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+        self.realization = pd.to_numeric(self.storms["realization"], errors="coerce").fillna(-1).to_numpy("int64")
+        self.block_group = pd.to_numeric(self.storms["block_group"], errors="coerce").fillna(-1).to_numpy("int64")
+
+        seasons = pd.Categorical(self.storms["historic_storm_season"].astype(str).str.lower())
+        self.season_categories = {season: code for code, season in enumerate(seasons.categories)}
+        self.season_codes = seasons.codes
+
+        precip = pd.to_numeric(self.storms["historic_storm_max_precip_inches"], errors="coerce").to_numpy("float64")
+        self.precip_order = np.argsort(precip, kind="stable")
+        # NaNs sort last, keep them out of range queries
+        self.sorted_precip = precip[self.precip_order]
+        self.precip_count = np.count_nonzero(~np.isnan(precip))
+
+        dates = pd.to_datetime(self.storms["historic_storm_date"], errors="coerce", utc=True)
+        self.storm_day = dates.dt.tz_localize(None).to_numpy("datetime64[D]")
+
+        ids = self.storms["ID"].astype(str).str.lower().to_numpy()
+        self.id_order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.id_order]
+
+    def search(
+        self,
+        realization: int = None,
+        block_group: int = None,
+        id_prefix: str = None,
+        min_precip: float = None,
+        storm_date: datetime.date = None,
+        season: str = None,
+    ) -> pd.DataFrame:
+        """Return the storms matching all given criteria (None or empty criteria are ignored)."""
+        query = query_key(realization, block_group, id_prefix, min_precip, storm_date, season)
+        with self._lock:
+            positions = self._cache.get(query)
+        if positions is None:
+            positions = self.positions(*query)
+            with self._lock:
+                if len(self._cache) >= MAX_CACHED_QUERIES:
+                    # drop the oldest query
+                    self._cache.pop(next(iter(self._cache)), None)
+                self._cache[query] = positions
+        # a new frame per call, so callers can modify it without changing the cached result of other sessions
+        return self.storms.iloc[positions]
+
+    def positions(self, realization, block_group, id_prefix, min_precip, storm_date, season) -> np.ndarray:
+        """Uncached row positions matching a normalized query (lower-cased id_prefix and season)."""
+        mask = np.ones(len(self.storms), dtype=bool)
+        if realization is not None:
+            mask &= self.realization == realization
+        if block_group:
+            mask &= self.block_group == block_group
+        if season:
+            mask &= self.season_codes == self.season_categories.get(season, -2)
+        if storm_date is not None:
+            mask &= self.storm_day == np.datetime64(storm_date, "D")
+        if min_precip:
+            start = np.searchsorted(self.sorted_precip[: self.precip_count], min_precip, side="left")
+            mask &= self._mask_from_positions(self.precip_order[start : self.precip_count])
+        if id_prefix:
+            start = np.searchsorted(self.sorted_ids, id_prefix, side="left")
+            stop = np.searchsorted(self.sorted_ids, id_prefix + "\uffff", side="left")
+            mask &= self._mask_from_positions(self.id_order[start:stop])
+        return np.flatnonzero(mask)
+
+    def _mask_from_positions(self, positions: np.ndarray) -> np.ndarray:
+        mask = np.zeros(len(self.storms), dtype=bool)
+        mask[positions] = True
+        return mask
+
+
+def mask_chain_search(
+    df: pd.DataFrame, realization=None, block_group=None, id_prefix=None, min_precip=None, storm_date=None, season=None
+) -> pd.DataFrame:
+    """The boolean mask chain the storm viewer used before StormIndex, kept as the benchmark baseline."""
+    if block_group:
+        df = df[df["block_group"] == block_group]
+    if realization is not None:
+        df = df[df["realization"] == realization]
+    if id_prefix:
+        df = df[df["ID"].str.contains(id_prefix, case=False, na=False)]
+    if min_precip:
+        df = df[df["historic_storm_max_precip_inches"] >= min_precip]
+    if storm_date:
+        df = df[df["historic_storm_date"].str.contains(storm_date.strftime("%Y-%m-%d"), case=False, na=False)]
+    if season:
+        df = df[df["historic_storm_season"].str.contains(season, case=False, na=False)]
+    return df
+
+
+def synthetic_storms(n: int = 100_000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    realization = rng.integers(1, 6, n)
+    event = np.arange(n)
+    dates = pd.Timestamp("1979-01-01") + pd.to_timedelta(rng.integers(0, 365 * 44, n), unit="D")
+    return pd.DataFrame(
+        {
+            "ID": [f"Kanawha-0505-R{r:03}-e{e:06}" for r, e in zip(realization, event)],
+            "event": event,
+            "block_group": rng.integers(1, 51, n),
+            "realization": realization,
+            "historic_storm_date": dates.strftime("%Y-%m-%dT%H:%M:%S"),
+            "historic_storm_season": rng.choice(["spring", "summer", "fall", "winter"], n),
+            "historic_storm_max_precip_inches": rng.gamma(2.0, 2.0, n).round(2),
+        }
+    )
+
+
+def benchmark(n: int = 100_000, repeat: int = 20):
+    """Time StormIndex.search (cold and cached) against the mask chain on a synthetic storms table."""
+    storms = synthetic_storms(n)
+    queries = [
+        {"realization": 3},
+        {"realization": 2, "min_precip": 8.0},
+        {"id_prefix": "Kanawha-0505-R004-e0001", "season": "summer"},
+        {"block_group": 7, "season": "winter", "min_precip": 4.0},
+        {"storm_date": datetime.date(1996, 1, 19)},
+    ]
+
+    start = time.perf_counter()
+    index = StormIndex(storms)
+    print(f"index build ({n} storms): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for query in queries:
+        baseline = mask_chain_search(storms, **query)
+        assert set(index.search(**query)["ID"]) == set(baseline["ID"]), query
+
+        timings = {}
+        for name, search in (
+            ("mask chain", lambda: mask_chain_search(storms, **query)),
+            ("index cold", lambda: index.storms.iloc[index.positions(*query_key(**query))]),
+            ("index cached", lambda: index.search(**query)),
+        ):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                search()
+            timings[name] = (time.perf_counter() - start) / repeat * 1000
+        print(f"{query}: {len(baseline)} rows | " + " | ".join(f"{k} {v:.2f} ms" for k, v in timings.items()))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable
+
+import fsspec
+import pandas as pd
+
+
+def version_token(uri: str) -> tuple:
+    """
+    Identify the current version of a parquet file or dataset directory from a single listing of its files
+    (ETags on S3, modification times locally), without downloading any data.
+    """
+    fs, path = fsspec.core.url_to_fs(uri)
+    fs.invalidate_cache(path)
+    files = fs.find(path, detail=True) if fs.isdir(path) else {path: fs.info(path)}
+    return tuple(
+        sorted((name, str(info.get("ETag") or info.get("mtime")), info.get("size")) for name, info in files.items())
+    )
+
+
+def _shared(value):
+    """Hand out shallow copies of cached DataFrames so callers adding columns don't modify the shared copy."""
+    return value.copy(deep=False) if isinstance(value, pd.DataFrame) else value
+
+
+class TableCache:
+    """
+    Process-wide cache of read-only, Arrow-backed DataFrames shared by all Streamlit sessions.
+
+    Entries are keyed by uri (and columns, key) and stored with the version token of the data they were read from.
+    Within ttl seconds an entry is served as is; after that it is revalidated with a listing of the uri and only
+    re-read if the version changed. Entries read on demand for many keys (e.g. one per gage) can be capped with
+    max_entries, evicting the least recently used.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+
+    def get(self, uri: str, loader: Callable, columns: list = None, key: tuple = None, max_entries: int = None):
+        """
+        Return the cached table (or object derived from it, e.g. an index) for uri, calling loader() to read it on a
+        miss.
+
+        key distinguishes several tables read from the same uri, e.g. the rows of a single gage. With max_entries, at
+        most that many entries of uri whose key starts like this one (e.g. with "gage") are kept.
+        """
+        group = (uri, key[0] if key else None)
+        key = (uri, tuple(columns) if columns else None, key)
+
+        with self._lock:
+            key_lock = self._key_locks[key]
+
+        # one loader per key at a time, so concurrent sessions wait for a single download
+        with key_lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now - entry["checked"] < self.ttl:
+                self._count("hits")
+                self._touch(key)
+                return _shared(entry["value"])
+
+            token = version_token(uri)
+            if entry is not None and entry["token"] == token:
+                entry["checked"] = now
+                self._count("hits")
+                self._count("revalidations")
+                self._touch(key)
+                return _shared(entry["value"])
+
+            self._count("misses")
+            value = loader()
+            with self._lock:
+                self._entries[key] = {"token": token, "checked": now, "value": value, "group": group}
+                self._entries.move_to_end(key)
+                if max_entries is not None:
+                    self._evict(group, max_entries)
+            return _shared(value)
+
+    def _touch(self, key: tuple):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def _evict(self, group: tuple, max_entries: int):
+        """Drop the least recently used entries of group beyond max_entries (holding self._lock)."""
+        keys = [key for key, entry in self._entries.items() if entry["group"] == group]
+        for key in keys[: max(len(keys) - max_entries, 0)]:
+            del self._entries[key]
+            key_lock = self._key_locks.get(key)
+            if key_lock is not None and not key_lock.locked():
+                del self._key_locks[key]
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+        }
+
+
+table_cache = TableCache()
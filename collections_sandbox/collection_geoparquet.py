@@ -0,0 +1,331 @@
+"""
+Export whole STAC collections to a single (stac-)geoparquet file and bulk-load them back into a STAC API.
+
+One row per item, following the stac-geoparquet layout: id, collection, type, stac_version, stac_extensions, bbox,
+geometry (WKB, described by GeoParquet metadata), assets and links, and every item property as a top-level typed
+column (datetime as a UTC timestamp). Property values that are objects or lists (e.g. HEC_RAS:model_summary, whose keys
+differ per item) or mix types (including ints and floats, which arrow would promote to floats), and the assets and
+links, are stored as JSON text and listed in the `stac:json_columns` schema metadata. The properties set to null by
+an item are listed in its `stac:null_properties` column (a null cell otherwise means the item lacks the property), so
+items round-trip exactly.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pystac
+import shapely
+from shapely.geometry import shape
+from utils import bulk_upsert_items, init_stac_session, search_items
+
+# Items converted to arrow at a time while exporting, and loaded per bulk request while importing
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 100))
+
+JSON_COLUMNS_KEY = b"stac:json_columns"
+NULL_PROPERTIES_COLUMN = "stac:null_properties"
+ITEM_SCHEMA = pa.schema(
+    [
+        ("type", pa.string()),
+        ("stac_version", pa.string()),
+        ("stac_extensions", pa.list_(pa.string())),
+        ("id", pa.string()),
+        ("collection", pa.string()),
+        ("bbox", pa.list_(pa.float64())),
+        ("geometry", pa.binary()),
+        ("assets", pa.string()),
+        ("links", pa.string()),
+        (NULL_PROPERTIES_COLUMN, pa.list_(pa.string())),
+    ]
+)
+ITEM_COLUMNS = ITEM_SCHEMA.names
+
+
+def _as_dict(item) -> dict:
+    if isinstance(item, pystac.Item):
+        return item.to_dict(include_self_link=False, transform_hrefs=False)
+    return item
+
+
+def items_to_table(items: Iterable) -> tuple:
+    """
+    Convert items (pystac.Item or dicts) to an arrow table of the export layout.
+
+    Returns
+    -------
+        tuple: The table and the names of its JSON-encoded columns.
+    """
+    items = [_as_dict(item) for item in items]
+    columns = {
+        "type": [item.get("type", "Feature") for item in items],
+        "stac_version": [item.get("stac_version") for item in items],
+        "stac_extensions": [item.get("stac_extensions", []) for item in items],
+        "id": [item["id"] for item in items],
+        "collection": [item.get("collection") for item in items],
+        "bbox": [item.get("bbox") for item in items],
+        "geometry": [shapely.to_wkb(shape(item["geometry"])) if item.get("geometry") else None for item in items],
+        "assets": [json.dumps(item.get("assets", {})) for item in items],
+        "links": [json.dumps(item.get("links", [])) for item in items],
+        NULL_PROPERTIES_COLUMN: [
+            [name for name, value in item["properties"].items() if value is None] for item in items
+        ],
+    }
+    arrays = {field.name: pa.array(columns[field.name], field.type) for field in ITEM_SCHEMA}
+    json_columns = ["assets", "links"]
+
+    names = list(dict.fromkeys(name for item in items for name in item["properties"]))
+    for name in names:
+        values = [item["properties"].get(name) for item in items]
+        if name == "datetime":
+            arrays[name] = pa.array(pd.to_datetime(values, utc=True, format="ISO8601"), type=pa.timestamp("us", "UTC"))
+            continue
+        try:
+            # a single python type per column, arrow would otherwise promote (e.g. ints and floats to floats)
+            if len({type(value) for value in values if value is not None}) > 1 or any(
+                isinstance(value, (dict, list)) for value in values
+            ):
+                raise pa.ArrowInvalid(name)
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays[name] = json_array(values)
+            json_columns.append(name)
+
+    table = pa.table(arrays)
+    return table, json_columns
+
+
+def json_array(values: list) -> pa.Array:
+    return pa.array([None if value is None else json.dumps(value) for value in values], pa.string())
+
+
+def union_bbox(bboxes: Iterable) -> list:
+    """Bounding box of the (2D or 3D) bboxes, None if there are none."""
+    bboxes = [bbox for bbox in bboxes if bbox]
+    if not bboxes:
+        return None
+    return [
+        min(bbox[0] for bbox in bboxes),
+        min(bbox[1] for bbox in bboxes),
+        max(bbox[-2] for bbox in bboxes),
+        max(bbox[-1] for bbox in bboxes),
+    ]
+
+
+def geo_metadata(bbox: list = None) -> dict:
+    """GeoParquet metadata of the WKB geometry column (EPSG:4326, as all STAC geometries) covering bbox."""
+    column = {"encoding": "WKB", "geometry_types": []}
+    if bbox:
+        column["bbox"] = bbox
+    return {"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column}}
+
+
+def unify_schemas(schemas: list, json_columns: set) -> pa.Schema:
+    """
+    Schema of the batches of a file: the union of their columns, in order of appearance. Columns JSON-encoded in one
+    batch, or typed differently in two batches (null columns aside), are JSON-encoded (added to json_columns).
+    """
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            known = fields.get(field.name)
+            if known is None or pa.types.is_null(known.type):
+                fields[field.name] = field
+            elif not pa.types.is_null(field.type) and field.type != known.type:
+                json_columns.add(field.name)
+    return pa.schema(
+        [pa.field(name, pa.string()) if name in json_columns else field for name, field in fields.items()]
+    )
+
+
+def conform_table(table: pa.Table, schema: pa.Schema, json_columns: set, encoded: list) -> pa.Table:
+    """Conform a batch (whose encoded columns are already JSON) to the schema of the file, see unify_schemas."""
+    arrays = []
+    for field in schema:
+        if field.name not in table.column_names:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+        elif field.name in json_columns and field.name not in encoded:
+            arrays.append(json_array(table.column(field.name).to_pylist()))
+        else:
+            arrays.append(table.column(field.name).cast(field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class GeoParquetWriter:
+    """
+    Write items (e.g. as new_collection builds them) to a single geoparquet file, in bounded memory.
+
+    Items are converted to arrow every batch_size items and each batch is written right away to a part file next to
+    path. close() writes the file from the parts, a row group per batch and reading one part at a time, with the schema
+    of all the batches (see unify_schemas): a batch can't fix the type of a column for the batches after it.
+    """
+
+    def __init__(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.written = 0
+        self._items = []
+        self._parts = []
+        self._parts_dir = None
+        self._bboxes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, item):
+        self._items.append(_as_dict(item))
+        if len(self._items) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._items:
+            return
+        table, json_columns = items_to_table(self._items)
+        self._items = []
+        if self._parts_dir is None:
+            # hidden from dataset discovery, on the same file system as path
+            self._parts_dir = tempfile.mkdtemp(prefix=".geoparquet-", dir=os.path.dirname(os.path.abspath(self.path)))
+        part = os.path.join(self._parts_dir, f"part-{len(self._parts):06d}.parquet")
+        pq.write_table(table, part)
+        self._parts.append((part, json_columns))
+        self._bboxes.append(union_bbox(table.column("bbox").to_pylist()))
+
+    def close(self) -> int:
+        """Write the file (once), returning the number of items written."""
+        self._flush()
+        if not self._parts:
+            return self.written
+
+        try:
+            json_columns = set().union(*(columns for _, columns in self._parts))
+            schema = unify_schemas([pq.read_schema(part) for part, _ in self._parts], json_columns)
+            metadata = {
+                b"geo": json.dumps(geo_metadata(union_bbox(self._bboxes))).encode(),
+                JSON_COLUMNS_KEY: json.dumps(sorted(json_columns)).encode(),
+            }
+            with pq.ParquetWriter(self.path, schema.with_metadata(metadata), compression="zstd") as writer:
+                for part, encoded in self._parts:
+                    table = conform_table(pq.read_table(part), schema, json_columns, encoded)
+                    writer.write_table(table, row_group_size=max(table.num_rows, 1))
+                    self.written += table.num_rows
+        finally:
+            shutil.rmtree(self._parts_dir, ignore_errors=True)
+            self._parts = []
+        logging.info(f"Wrote {self.written} items to {self.path}")
+        return self.written
+
+
+def export_collection(stac_api_url: str, collection_id: str, path: str, session=None, page_size: int = 500) -> int:
+    """Export every item of a collection in a STAC API to a geoparquet file, returning the number of items."""
+    session = session or init_stac_session()
+    with GeoParquetWriter(path) as writer:
+        for item in search_items(stac_api_url, {"collections": [collection_id], "limit": page_size}, session=session):
+            writer.add(item)
+    return writer.close()
+
+
+def iter_geoparquet_items(path: str, batch_size: int = EXPORT_BATCH_SIZE, columns: list = None) -> Iterator[dict]:
+    """
+    Yield the items (as dicts) of a file written by GeoParquetWriter, a record batch at a time.
+
+    With columns, only those of the file are read (e.g. to skip the geometries and links of large collections), and the
+    item fields and properties of the others are left out of the items.
+    """
+    parquet = pq.ParquetFile(path)
+    json_columns = set(json.loads(parquet.schema_arrow.metadata.get(JSON_COLUMNS_KEY, b"[]")))
+    if columns is not None:
+        columns = [column for column in [*columns, NULL_PROPERTIES_COLUMN] if column in parquet.schema_arrow.names]
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        for row in batch.to_pylist():
+            item = {name: row[name] for name in ("type", "stac_version", "stac_extensions", "id") if name in row}
+            if "geometry" in row:
+                geometry = row["geometry"]
+                item["geometry"] = shapely.geometry.mapping(shapely.from_wkb(geometry)) if geometry else None
+            if "bbox" in row:
+                item["bbox"] = row["bbox"]
+            item["properties"] = {}
+            for name in ("links", "assets"):
+                if name in row:
+                    item[name] = json.loads(row[name])
+            if row.get("collection") is not None:
+                item["collection"] = row["collection"]
+            null_properties = set(row.get(NULL_PROPERTIES_COLUMN) or [])
+            for name, value in row.items():
+                if name in ITEM_COLUMNS or (value is None and name not in null_properties):
+                    continue
+                if value is None:
+                    pass
+                elif name == "datetime":
+                    value = pystac.utils.datetime_to_str(value)
+                elif name in json_columns:
+                    value = json.loads(value)
+                item["properties"][name] = value
+            if "datetime" not in item["properties"]:
+                item["properties"]["datetime"] = None
+            yield item
+
+
+def import_collection(
+    path: str, stac_api_url: str, collection_id: str = None, batch_size: int = IMPORT_BATCH_SIZE, session=None
+) -> list:
+    """
+    Bulk-load the items of a geoparquet file into a collection of a STAC API (by default the collection the items were
+    exported from), batch_size items per bulk request (see utils.bulk_upsert_items).
+
+    Returns
+    -------
+        list: One result summary per item.
+    """
+    session = session or init_stac_session()
+    results = []
+    batch = []
+
+    def flush():
+        target = collection_id or batch[0].collection_id
+        results.extend(
+            bulk_upsert_items(stac_api_url, target, batch, headers={}, batch_size=batch_size, session=session)
+        )
+        batch.clear()
+
+    for item_dict in iter_geoparquet_items(path):
+        if collection_id is not None:
+            item_dict["collection"] = collection_id
+        item = pystac.Item.from_dict(item_dict, preserve_dict=False)
+        if batch and item.collection_id != batch[0].collection_id:
+            flush()
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export a STAC collection to geoparquet, or import one back.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write the items of a collection to a geoparquet file")
+    export_parser.add_argument("collection_id")
+    export_parser.add_argument("path")
+    import_parser = subparsers.add_parser("import", help="bulk-load the items of a geoparquet file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--collection-id", default=None, help="target collection, defaults to the exported one")
+    args = parser.parse_args()
+
+    stac_api_url = os.getenv("STAC_API_URL")
+    if args.command == "export":
+        export_collection(stac_api_url, args.collection_id, args.path)
+    else:
+        results = import_collection(args.path, stac_api_url, args.collection_id)
+        logging.info(f"Imported {sum(result['action'] != 'failed' for result in results)} of {len(results)} items")
@@ -0,0 +1,129 @@
+import os
+import time
+from contextlib import contextmanager
+
+import fsspec
+import numpy as np
+import pandas as pd
+from model_info import (
+    get_vol_error,
+    sanitize_reference_summary_data,
+    sanitize_summary_results_data,
+)
+from rashdf import RasPlanHdf
+from rashdf.utils import parse_ras_datetime_ms
+
+# Plan HDFs are multi-GB but the summary needs only the HDF5 metadata on the path to the Summary groups and the
+# reference line datasets. These are small pieces spread over the file: a block cache coalesces neighbouring reads
+# (object headers, B-tree nodes, heaps, small datasets) into a single ranged GET per block and keeps the blocks
+# shared by several reads (e.g. the root group and the superblock) for the whole extraction.
+HDF_CACHE_TYPE = os.getenv("HDF_CACHE_TYPE", "blockcache")
+HDF_BLOCK_SIZE = int(os.getenv("HDF_BLOCK_SIZE", 512 * 2**10))
+HDF_MAX_BLOCKS = int(os.getenv("HDF_MAX_BLOCKS", 64))
+
+# Only the variables reported in the item summary, rashdf's reference_summary_output also reads Velocity
+REFERENCE_LINE_VARIABLES = {"Flow": "q", "Water Surface": "ws"}
+
+
+class FetchCounter:
+    """Wraps the fetcher of an fsspec file cache to count the ranged requests and bytes read from storage."""
+
+    def __init__(self, fetcher, size: int):
+        self.fetcher = fetcher
+        self.size = size
+        self.requests = 0
+        self.bytes = 0
+
+    def __call__(self, start: int, end: int) -> bytes:
+        data = self.fetcher(start, end)
+        self.requests += 1
+        self.bytes += len(data)
+        return data
+
+
+@contextmanager
+def open_plan_hdf(
+    uri: str,
+    cache_type: str = HDF_CACHE_TYPE,
+    block_size: int = HDF_BLOCK_SIZE,
+    max_blocks: int = HDF_MAX_BLOCKS,
+    storage_options: dict = None,
+):
+    """
+    Open a plan HDF once, through an fsspec file with the given cache, closing the file and the remote handle on exit.
+
+    Yields the RasPlanHdf and the FetchCounter of the underlying file (None for file systems reading without a cache,
+    e.g. local files).
+    """
+    fs, path = fsspec.core.url_to_fs(uri, **(storage_options or {}))
+    open_kwargs = {"block_size": block_size, "cache_type": cache_type}
+    if cache_type == "blockcache":
+        open_kwargs["cache_options"] = {"maxblocks": max_blocks}
+
+    with fs.open(path, mode="rb", **open_kwargs) as remote_file:
+        counter = None
+        if hasattr(remote_file, "cache"):
+            counter = FetchCounter(remote_file.cache.fetcher, remote_file.size)
+            remote_file.cache.fetcher = counter
+        with RasPlanHdf(remote_file) as plan:
+            yield plan, counter
+
+
+def reference_lines_summary(plan: RasPlanHdf) -> pd.DataFrame:
+    """
+    Maximum flow and water surface (and their times) of each reference line.
+
+    Same values (and column names) as rashdf's reference_summary_output, reading only the names, the Flow and Water
+    Surface datasets and the timestamps at which the maxima occur.
+    """
+    group = plan.get(plan.REFERENCE_LINES_OUTPUT_PATH)
+    if group is None:
+        return pd.DataFrame(columns=["refln_id", "refln_name", "mesh_name"])
+
+    names, meshes = zip(*(name.decode("utf-8").split("|") for name in group["Name"][:]))
+    data = {"refln_id": np.arange(len(names)), "refln_name": list(names), "mesh_name": list(meshes)}
+
+    stamps = plan[f"{plan.UNSTEADY_TIME_SERIES_PATH}/Time Date Stamp (ms)"]
+    for var, abbrev in REFERENCE_LINE_VARIABLES.items():
+        if var not in group:
+            continue
+        values = group[var][:]
+        max_index = np.argmax(np.nan_to_num(values, nan=-np.inf), axis=0)
+        # h5py point selections must be increasing and unique
+        time_indexes = np.unique(max_index)
+        times = dict(zip(time_indexes, (parse_ras_datetime_ms(s.decode("utf-8")) for s in stamps[time_indexes])))
+        data[f"max_{abbrev}"] = np.nanmax(values, axis=0)
+        data[f"max_{abbrev}_time"] = pd.to_datetime([times[i] for i in max_index])
+    return pd.DataFrame(data)
+
+
+def summarize_plan_hdf(uri: str, columnar: bool = False, **open_kwargs) -> dict:
+    """
+    Extract the item summary of a plan HDF with a single open of the file.
+
+    Reads only the /Results/Unsteady/Summary attributes, the 2D volume accounting attributes and the reference line
+    datasets (see reference_lines_summary).
+
+    Returns
+    -------
+        dict: volume_error, summary_output and reference_summary_output (formatted as by the model_info helpers) and
+        read_stats, with the bytes and ranged requests fetched from storage and the extraction time. The reference
+        summary is columnar when columnar is True.
+    """
+    start = time.perf_counter()
+    with open_plan_hdf(uri, **open_kwargs) as (plan, counter):
+        summary = {
+            "volume_error": get_vol_error(plan),
+            "summary_output": sanitize_summary_results_data(plan),
+            "reference_summary_output": sanitize_reference_summary_data(
+                reference_lines_summary(plan), columnar=columnar
+            ),
+        }
+
+    summary["read_stats"] = {
+        "file_bytes": counter.size if counter else None,
+        "fetched_bytes": counter.bytes if counter else None,
+        "fetch_requests": counter.requests if counter else None,
+        "elapsed_s": round(time.perf_counter() - start, 3),
+    }
+    return summary
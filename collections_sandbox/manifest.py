@@ -0,0 +1,157 @@
+"""Local SQLite manifest used to make collection builds incremental and resumable."""
+
+import datetime
+import hashlib
+import json
+import logging
+import sqlite3
+
+import pystac
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_prefix TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    assets TEXT NOT NULL,
+    item_id TEXT,
+    item_hash TEXT,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS block_groups (
+    collection_id TEXT NOT NULL,
+    realization INTEGER NOT NULL,
+    block_group INTEGER NOT NULL,
+    completed TEXT NOT NULL,
+    PRIMARY KEY (collection_id, realization, block_group)
+);
+"""
+
+# Item property holding item_hash, compared with the API by `utils.sync_items`
+CONTENT_HASH_PROPERTY = "FFRD:content_hash"
+
+
+def objects_fingerprint(objects: list) -> str:
+    """Hash the keys, ETags and last-modified times of an event listing (as yielded by `utils.list_objects`)."""
+    digest = hashlib.sha256()
+    for obj in sorted(objects, key=lambda o: o["Key"]):
+        digest.update(f'{obj["Key"]}|{obj["ETag"]}|{obj["LastModified"].isoformat()}\n'.encode())
+    return digest.hexdigest()
+
+
+def item_hash(item: pystac.Item) -> str:
+    """Hash the content of a STAC item, ignoring the build timestamp (and the hash stored in the item)."""
+    item_dict = item.to_dict(include_self_link=False, transform_hrefs=False)
+    item_dict["properties"] = {
+        k: v for k, v in item_dict["properties"].items() if k not in ("datetime", CONTENT_HASH_PROPERTY)
+    }
+    return hashlib.sha256(json.dumps(item_dict, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BuildManifest:
+    """
+    Sidecar manifest keyed by event prefix, recording the assets seen and the item emitted for each event.
+
+    Event records are written in the current transaction and only committed by `commit` (once their items are
+    upserted) or `mark_block_group_complete`, so a crash before an item is upserted leaves its event unrecorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def event_unchanged(self, event_prefix: str, fingerprint: str) -> bool:
+        """Check whether an event prefix has the same S3 contents as when its item was last emitted."""
+        row = self.conn.execute("SELECT fingerprint FROM events WHERE event_prefix = ?", (event_prefix,)).fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def item_unchanged(self, event_prefix: str, item: pystac.Item) -> bool:
+        """Check whether an item has the same content as the one last emitted for the event prefix."""
+        row = self.conn.execute("SELECT item_hash FROM events WHERE event_prefix = ?", (event_prefix,)).fetchone()
+        return row is not None and row[0] == item_hash(item)
+
+    def recorded_item(self, event_prefix: str) -> tuple:
+        """(item id, item hash) last emitted for an event prefix, (None, None) if it was never recorded."""
+        row = self.conn.execute(
+            "SELECT item_id, item_hash FROM events WHERE event_prefix = ?", (event_prefix,)
+        ).fetchone()
+        return tuple(row) if row is not None else (None, None)
+
+    def forget_events(self, event_prefixes: list):
+        """Drop the records of events so the next build harvests them again."""
+        self.conn.executemany("DELETE FROM events WHERE event_prefix = ?", ((prefix,) for prefix in event_prefixes))
+        self.conn.commit()
+
+    def record_event(self, event_prefix: str, objects: list, item: pystac.Item):
+        """Record the listing and emitted item of an event (committed with the block group)."""
+        assets = {
+            obj["Key"]: {"e_tag": obj["ETag"].strip('"'), "last_modified": obj["LastModified"].isoformat()}
+            for obj in objects
+        }
+        self.conn.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                event_prefix,
+                objects_fingerprint(objects),
+                json.dumps(assets),
+                item.id,
+                item_hash(item),
+                datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            ),
+        )
+
+    def commit(self):
+        """Commit the event records of upserted items."""
+        self.conn.commit()
+
+    def merge(self, path: str) -> dict:
+        """
+        Merge the records of another manifest (e.g. of one shard of a build), keeping the most recent record of each
+        event, and commit. Returns the number of event and block group records merged.
+        """
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            events = self.conn.execute("""
+                INSERT OR REPLACE INTO events
+                SELECT o.* FROM other.events o LEFT JOIN events e ON e.event_prefix = o.event_prefix
+                WHERE e.event_prefix IS NULL OR o.updated > e.updated
+                """).rowcount
+            block_groups = self.conn.execute(
+                "INSERT OR REPLACE INTO block_groups SELECT * FROM other.block_groups"
+            ).rowcount
+            self.conn.commit()
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+        return {"events": events, "block_groups": block_groups}
+
+    def block_group_complete(self, collection_id: str, realization: int, block_group: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM block_groups WHERE collection_id = ? AND realization = ? AND block_group = ?",
+            (collection_id, realization, block_group),
+        ).fetchone()
+        return row is not None
+
+    def mark_block_group_complete(self, collection_id: str, realization: int, block_group: int):
+        """Mark a block group as upserted and commit its event records."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO block_groups VALUES (?, ?, ?, ?)",
+            (collection_id, realization, block_group, datetime.datetime.now(datetime.timezone.utc).isoformat()),
+        )
+        self.conn.commit()
+
+    def discard_pending(self):
+        """Drop the event records of the current (failed) block group."""
+        self.conn.rollback()
+
+    def reset_block_groups(self, collection_id: str, realization: int):
+        """Forget block group completion (but keep event records) so a new run revisits every block group."""
+        logging.info(f"Resetting block group checkpoints for {collection_id} realization {realization}")
+        self.conn.execute(
+            "DELETE FROM block_groups WHERE collection_id = ? AND realization = ?", (collection_id, realization)
+        )
+        self.conn.commit()
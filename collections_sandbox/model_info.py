@@ -1,25 +1,68 @@
+import logging
+
+import pandas as pd
 from rashdf import RasPlanHdf
 
 bucket_name = "kanawha-pilot"
 s3_uri = f"s3://{bucket_name}/FFRD_Kanawha_Compute/sims/uncertainty_10_by_500_no_bootstrap_5_10a_2024/1/ras/ElkMiddle/ElkMiddle.p01.hdf"
 
-ds = RasPlanHdf.open_uri(s3_uri)
 
+# reference_summary_output columns -> item summary fields, in the order they appear in the item
+REFERENCE_SUMMARY_FIELDS = {
+    "max_q_time": "max_flow_time",
+    "max_q": "max_flow_value",
+    "max_ws_time": "max_wse_time",
+    "max_ws": "max_wse_value",
+}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def sanitize_reference_summary_output(ds, columnar: bool = False):
+    return sanitize_reference_summary_data(ds.reference_summary_output(), columnar=columnar)
+
+
+def reference_summary_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reference summary with the item summary field names, times formatted and values rounded column-wise.
+
+    Fields whose column is missing (plans without reference lines, or without Flow or Water Surface output) and missing
+    values are None. Reference lines repeated in a mesh are reported and only the last one is kept, as the mapping has
+    one entry per gage name.
+    """
+    frame = pd.DataFrame({"mesh_name": data["mesh_name"].astype(str), "gage": data["refln_name"].astype(str)})
+    for column, field in REFERENCE_SUMMARY_FIELDS.items():
+        values = data[column] if column in data else pd.Series(float("nan"), index=data.index)
+        if field.endswith("_time"):
+            frame[field] = pd.to_datetime(values).dt.strftime(TIME_FORMAT)
+        else:
+            frame[field] = values.astype("float64").round(2)
+
+    duplicated = frame.duplicated(["mesh_name", "gage"], keep="last")
+    if duplicated.any():
+        logging.warning(
+            f"Duplicate reference lines, keeping the last of each: "
+            f"{sorted(set(zip(frame['mesh_name'][duplicated], frame['gage'][duplicated])))}"
+        )
+        frame = frame[~duplicated]
+    return frame.astype(object).where(frame.notna(), None)
+
+
+def sanitize_reference_summary_data(data: pd.DataFrame, columnar: bool = False) -> dict:
+    """
+    Convert a reference summary (rashdf reference_summary_output) to the item summary.
 
-def sanitize_reference_summary_output(ds):
-    data = ds.reference_summary_output()
-    results = {}
-    for mesh in data["mesh_name"].unique():
-        results[mesh] = {}
+    By default returns the {mesh_name: {gage: {max_flow_time, max_flow_value, max_wse_time, max_wse_value}}} mapping
+    stored on the HDF assets. With columnar=True returns one list per column (mesh_name, gage and the summary fields),
+    the rows the ETL writes to the gages table, so it doesn't have to flatten the nested mapping.
+    """
+    frame = reference_summary_frame(data)
+    if columnar:
+        return frame.to_dict("list")
 
-        for row in data.itertuples():
-            results[mesh][row.refln_name] = {
-                "max_flow_time": row.max_q_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "max_flow_value": round(row.max_q, 2),
-                "max_wse_time": row.max_ws_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "max_wse_value": round(row.max_ws, 2),
-            }
-    return results
+    fields = list(REFERENCE_SUMMARY_FIELDS.values())
+    return {
+        mesh: group.set_index("gage")[fields].to_dict("index") for mesh, group in frame.groupby("mesh_name", sort=False)
+    }
 
 
 def sanitize_summary_results_data(ds):
@@ -35,13 +78,16 @@ def sanitize_summary_results_data(ds):
 
 
 def get_vol_error(ds):
-    for mesh_name in ds.mesh_area_names():
+    # the Volume Accounting 2D group has one subgroup per mesh, no need to read the geometry for the mesh names
+    for mesh_name in ds[f"{ds.VOLUME_ACCOUNTING_PATH}/Volume Accounting 2D"]:
         # TODO: (Fix) this assumes the mesh has a single area and will overwrite results if there are more than 1....
-        sum_vol_error = ds.get_attrs(f"/Results/Unsteady/Summary/Volume Accounting/Volume Accounting 2D/{mesh_name}")
+        sum_vol_error = ds.get_attrs(f"{ds.VOLUME_ACCOUNTING_PATH}/Volume Accounting 2D/{mesh_name}")
         sum_vol_error = {k: round(v, 2) for k, v in sum_vol_error.items()}
     return sum_vol_error
 
 
-sum_output = sanitize_reference_summary_output(ds)
-# sum_results = sanitize_summary_results_data(ds)
-# vol_error = get_vol_error(ds)
+if __name__ == "__main__":
+    ds = RasPlanHdf.open_uri(s3_uri)
+    sum_output = sanitize_reference_summary_output(ds)
+    # sum_results = sanitize_summary_results_data(ds)
+    # vol_error = get_vol_error(ds)
@@ -1,30 +1,46 @@
+import argparse
 import datetime
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
 # from random import randint, uniform
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pystac
 from dotenv import load_dotenv
 from kanawha_model_data import hms_links, ras_links, ressim_links, storm_view_links
-from model_info import (
-    get_vol_error,
-    sanitize_reference_summary_output,
-    sanitize_summary_results_data,
-)
-from rashdf import RasPlanHdf
-from storm_info import storm_info_to_stac_metadata
+from collection_geoparquet import GeoParquetWriter
+from hdf_summary import summarize_plan_hdf
+from manifest import CONTENT_HASH_PROPERTY, BuildManifest, item_hash, objects_fingerprint
+from shard_plan import parse_shard, read_plan, realization_block_groups, shard_manifest_path
+from storm_info import get_storm_lookup, storm_info_to_stac_metadata, storms_to_stac_metadata
 from utils import (
+    bulk_upsert_items,
+    collection_exists,
     create_collection,
     # delete_collection,
-    get_basic_object_metadata,
+    delete_items,
     init_s3_resources,
-    list_keys,
+    init_stac_session,
+    list_item_hashes,
+    list_objects,
+    retry_with_backoff,
+    s3_metadata_from_listing,
     str_from_s3,
+    sync_items,
     upsert_collection,
-    upsert_item,
 )
 
 load_dotenv()
@@ -38,185 +54,1046 @@ SIMULATION_OUTPUT_PREFIX = "FFRD_Kanawha_Compute/sims/uncertainty_10_by_500_no_b
 COLLECTION_ID = "R001"
 REALZIATION = 1
 
+# Number of S3 keys harvested concurrently per event, and retries (with exponential backoff) per key
+HARVEST_WORKERS = int(os.getenv("HARVEST_WORKERS", 16))
+HARVEST_RETRIES = int(os.getenv("HARVEST_RETRIES", 3))
+
+# Items per bulk_items request, and concurrent requests when the API only supports per-item transactions
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", 100))
+UPSERT_WORKERS = int(os.getenv("UPSERT_WORKERS", 8))
+
+# Processes summarizing plan HDFs (their ranged reads, h5py decoding, pandas and datetime formatting), fed by the harvest
+# threads without waiting for them, and number of events harvested concurrently (bounding the assets and items held in
+# memory)
+HDF_WORKERS = int(os.getenv("HDF_WORKERS", os.cpu_count() or 1))
+MAX_IN_FLIGHT_EVENTS = int(os.getenv("MAX_IN_FLIGHT_EVENTS", 32))
+# Bulk upsert requests running while the next items are harvested
+MAX_IN_FLIGHT_UPSERTS = int(os.getenv("MAX_IN_FLIGHT_UPSERTS", 2))
+
+# How long the shards of a sharded build wait for shard 0 to create the collection
+COLLECTION_WAIT_S = float(os.getenv("COLLECTION_WAIT_S", 3600))
+
+# Store the HDF asset reference summaries nested by mesh (default) or as columns, read as is by etl/stac_to_pqs.py
+COLUMNAR_REFERENCE_SUMMARY = os.getenv("COLUMNAR_REFERENCE_SUMMARY", "false").lower() == "true"
+
+# Build compact items (see compact_item): the links and basin geometry shared by all items are left to the collection,
+# and the reference summaries of the HDF assets are written to a parquet sidecar asset per item
+COMPACT_ITEMS = os.getenv("COMPACT_ITEMS", "false").lower() == "true"
+GAGE_SUMMARY_PREFIX = f"stac/Kanawha-0505/gage-summaries/{COLLECTION_ID}"
+GAGE_SUMMARY_ASSET = "gage-summary"
+GAGE_SUMMARY_SCHEMA = pa.schema(
+    [
+        ("ras_model", pa.string()),
+        ("mesh_name", pa.string()),
+        ("gage", pa.string()),
+        ("max_flow_time", pa.string()),
+        ("max_flow_value", pa.float64()),
+        ("max_wse_time", pa.string()),
+        ("max_wse_value", pa.float64()),
+    ]
+)
+SHARED_LINKS = [*ras_links, *hms_links, *ressim_links, *storm_view_links]
+
+
+_thread_local = threading.local()
+
+
+def _thread_s3_client():
+    """Return an S3 client private to the calling thread."""
+    if not hasattr(_thread_local, "client"):
+        _, _thread_local.client, _ = init_s3_resources()
+    return _thread_local.client
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def throughput_report(latencies: list, elapsed: float) -> dict:
+    """Summarize harvest throughput (keys/s) and per-key harvest latency percentiles in milliseconds."""
+    latencies = sorted(latencies)
+    return {
+        "keys": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "keys_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "key_p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "key_p90_ms": round(_percentile(latencies, 90) * 1000, 1),
+        "key_p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "key_max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def init_hdf_pool(max_workers: int = HDF_WORKERS) -> ProcessPoolExecutor:
+    """
+    Process pool for summarize_plan_hdf. Workers are spawned rather than forked since the pool is used while the harvest
+    threads (and their boto3 clients) are running.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
 
-def main(event_ids: list, block_group: int, realization: int = REALZIATION):
-    _, client, resource = init_s3_resources()
-    event_items = []
 
+def summarize_hdf(uri: str, hdf_pool: ProcessPoolExecutor = None, retries: int = HARVEST_RETRIES) -> Future:
+    """
+    summarize_plan_hdf (retried on OSError) submitted to hdf_pool without waiting for it, or run in the calling thread
+    when there is no pool. Either way the summary (or its exception) is returned as a future.
+    """
+    args = (summarize_plan_hdf, uri)
+    kwargs = {"retries": retries, "exceptions": (OSError,), "columnar": COLUMNAR_REFERENCE_SUMMARY}
+    future = Future()
+    try:
+        if hdf_pool is not None:
+            return hdf_pool.submit(retry_with_backoff, *args, **kwargs)
+        future.set_result(retry_with_backoff(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+@lru_cache(maxsize=1)
+def basin_geometry() -> tuple:
+    """Bounding box and geometry shared by all event items."""
     gdf = gpd.read_file(KANAWHA_BASIN_SIMPLE_GEOMETRY, layer="simplified")
-    bbox = gdf.total_bounds.tolist()
-    geometry = gdf.union_all().__geo_interface__
-
-    for event in event_ids:
-        # make sure to include the trailing / in the prefix
-        event_prefix = f"{SIMULATION_OUTPUT_PREFIX}/{event}/"
-        event_keys = list_keys(client, BUCKET_NAME, event_prefix)
-
-        logging.info(f"Block Group {block_group} | Event {event_prefix}: processing {len(event_keys)} Assets")
-
-        item_id = f"{COLLECTION_ID}-r{realization:03}-e{event:04}"
-
-        item = pystac.Item(id=item_id, geometry=geometry, bbox=bbox, datetime=datetime.datetime.now(), properties={})
-
-        item.properties["metadata_version"] = "Experimental"
-
-        item.validate()
-        ras_model_summary = {}
-        storm_summary = {}
-
-        for key in event_keys:
-            added_roles = []
-
-            key_parts = key.split("/")
-            plugin_tag = f"{key_parts[4]}-plugin"
-            if plugin_tag == "ras-plugin":
-                plugin_tag = "ras-runner-pluign"
-            elif plugin_tag == "grids":
-                plugin_tag = "map-products-plugin"
-
-            suffix = Path(key).suffix
-            file_name = Path(key).name
-
-            bucket_resource = resource.Bucket(BUCKET_NAME)
-
-            s3_metadata = get_basic_object_metadata(bucket_resource.Object(key))
-
-            if suffix == ".log":
-                media_type = pystac.MediaType.TEXT
-                added_roles.append("simulation-log")
-
-            elif suffix == ".json":
-                media_type = pystac.MediaType.JSON
-            elif suffix == ".tif":
-                media_type = pystac.MediaType.GEOTIFF
-            elif suffix == ".met":
-                media_type = pystac.MediaType.TEXT
-                added_roles.append("sst-data")
-                try:
-                    storm_summary = storm_info_to_stac_metadata(client, f"s3://{BUCKET_NAME}/{key}")
-                except Exception as e:
-                    logging.error(f"{file_name}: Failed to get storm info {e}")
-            elif suffix == ".grid":
-                media_type = pystac.MediaType.TEXT
-            elif suffix == ".dss":
-                media_type = "application/octet-stream"
-            elif suffix == ".hdf":
-                media_type = pystac.MediaType.HDF5
-                try:
-                    ds = RasPlanHdf.open_uri(f"s3://{BUCKET_NAME}/{key}")
-                    s3_metadata["hec_ras:volume_error"] = get_vol_error(ds)
-
-                    s3_metadata["hec_ras:summary_output"] = sanitize_summary_results_data(ds)
-
-                    ras_model_summary[file_name] = {
-                        "excess_precip_inches": s3_metadata["hec_ras:volume_error"]["Precip Excess (inches)"],
-                        "volume_error_pct": s3_metadata["hec_ras:volume_error"]["Error Percent"],
-                        # "max_wsel_error": s3_metadata["hec_ras:summary_output"]["Maximum WSEL Error"],
-                        "computation_time_minutes": s3_metadata["hec_ras:summary_output"][
-                            "Computation Time Total (minutes)"
-                        ],
-                    }
-
-                    s3_metadata["hec_ras:reference_summary_output"] = sanitize_reference_summary_output(ds)
-                    added_roles.append("ras-simulation")
-                    logging.info(file_name, s3_metadata["hec_ras:summary_output"]["Computation Time Total (minutes)"])
-                except Exception as e:
-                    logging.error(file_name, e)
+    return gdf.total_bounds.tolist(), gdf.union_all().__geo_interface__
 
-            else:
-                media_type = None
 
-            asset = pystac.Asset(
-                href=f"s3://{BUCKET_NAME}/{key}",
-                media_type=media_type,
-                roles=[plugin_tag, *added_roles],
-                extra_fields=s3_metadata,
+def harvest_asset(
+    obj: dict,
+    region: str,
+    retries: int = HARVEST_RETRIES,
+    hdf_pool: ProcessPoolExecutor = None,
+    storm_summary: dict = None,
+) -> dict:
+    """
+    Collect the metadata for a single S3 object summary (from `list_objects`) and build its STAC asset.
+
+    Safe to call from worker threads; the caller is responsible for adding the results to the item in key order.
+    When hdf_pool is given, plan HDFs are summarized in the pool without holding the calling thread: the result has the
+    hdf_summary future, added to the asset by add_hdf_summary once it is done. The storm summary of a .met file is
+    storm_summary when given (resolved in bulk, see storms_to_stac_metadata), otherwise (or when the bulk resolution
+    failed) it is looked up for the file alone.
+
+    Returns
+    -------
+        dict: The asset file name, the pystac.Asset, the harvest latency in seconds (not including plan HDFs summarized
+        in hdf_pool), when available the RAS model summary (.hdf) or storm summary (.met, {} when the storm is not in
+        the storm catalog) for the event, and error, True when the summary could not be extracted because of a failure
+        (the asset is still built without it).
+    """
+    client = _thread_s3_client()
+    harvest_start = time.perf_counter()
+    key = obj["Key"]
+    added_roles = []
+    result = {"ras_model_summary": None, "storm_summary": None, "error": False}
+
+    key_parts = key.split("/")
+    plugin_tag = f"{key_parts[4]}-plugin"
+    if plugin_tag == "ras-plugin":
+        plugin_tag = "ras-runner-pluign"
+    elif plugin_tag == "grids":
+        plugin_tag = "map-products-plugin"
+
+    suffix = Path(key).suffix
+    file_name = Path(key).name
+
+    s3_metadata = s3_metadata_from_listing(obj, region)
+
+    if suffix == ".log":
+        media_type = pystac.MediaType.TEXT
+        added_roles.append("simulation-log")
+
+    elif suffix == ".json":
+        media_type = pystac.MediaType.JSON
+    elif suffix == ".tif":
+        media_type = pystac.MediaType.GEOTIFF
+    elif suffix == ".met":
+        media_type = pystac.MediaType.TEXT
+        added_roles.append("sst-data")
+        try:
+            if storm_summary is None:
+                storm_summary = storm_info_to_stac_metadata(client, f"s3://{BUCKET_NAME}/{key}")
+            result["storm_summary"] = storm_summary
+        except Exception as e:
+            logging.error(f"{file_name}: Failed to get storm info {e}")
+            result["error"] = True
+    elif suffix == ".grid":
+        media_type = pystac.MediaType.TEXT
+    elif suffix == ".dss":
+        media_type = "application/octet-stream"
+    elif suffix == ".hdf":
+        media_type = pystac.MediaType.HDF5
+        # one open per plan HDF, reading only the summary groups and reference line datasets
+        result["hdf_summary"] = summarize_hdf(f"s3://{BUCKET_NAME}/{key}", hdf_pool, retries=retries)
+
+    else:
+        media_type = None
+
+    result["latency"] = time.perf_counter() - harvest_start
+    result["file_name"] = file_name
+    result["asset"] = pystac.Asset(
+        href=f"s3://{BUCKET_NAME}/{key}",
+        media_type=media_type,
+        roles=[plugin_tag, *added_roles],
+        extra_fields=s3_metadata,
+    )
+    if hdf_pool is None:
+        add_hdf_summary(result)
+    return result
+
+
+def add_hdf_summary(result: dict) -> dict:
+    """
+    Wait for the plan HDF summary of a harvest_asset result (if any) and add it to its asset and to the RAS model
+    summary of the result, setting error when it could not be extracted.
+    """
+    future = result.pop("hdf_summary", None)
+    if future is None:
+        return result
+
+    file_name = result["file_name"]
+    asset = result["asset"]
+    try:
+        hdf_summary = future.result()
+        volume_error, summary_output = hdf_summary["volume_error"], hdf_summary["summary_output"]
+        result["ras_model_summary"] = {
+            "excess_precip_inches": volume_error["Precip Excess (inches)"],
+            "volume_error_pct": volume_error["Error Percent"],
+            # "max_wsel_error": summary_output["Maximum WSEL Error"],
+            "computation_time_minutes": summary_output["Computation Time Total (minutes)"],
+        }
+
+        asset.extra_fields["hec_ras:volume_error"] = volume_error
+        asset.extra_fields["hec_ras:summary_output"] = summary_output
+        asset.extra_fields["hec_ras:reference_summary_output"] = hdf_summary["reference_summary_output"]
+        asset.roles.append("ras-simulation")
+        logging.info(
+            f"{file_name}: {summary_output['Computation Time Total (minutes)']} minutes, "
+            f"read {hdf_summary['read_stats']}"
+        )
+    except Exception as e:
+        logging.error(f"{file_name}: Failed to summarize plan HDF {e}")
+        result["error"] = True
+    return result
+
+
+def event_output_prefix(event: int) -> str:
+    # make sure to include the trailing / in the prefix
+    return f"{SIMULATION_OUTPUT_PREFIX}/{event}/"
+
+
+def event_item_id(event: int, realization: int = REALZIATION) -> str:
+    return f"{COLLECTION_ID}-r{realization:03}-e{event:04}"
+
+
+def build_event_item(
+    event: int, block_group: int, realization: int, results: list, compact: bool = COMPACT_ITEMS
+) -> tuple:
+    """
+    Build the STAC item of an event from the harvest_asset results of its objects (in key order), with its content
+    hash (see manifest.item_hash) in the CONTENT_HASH_PROPERTY property. With compact, see compact_item.
+
+    Returns
+    -------
+        tuple: The item, and the gage summary sidecar of compact items to write before it is upserted (see
+        write_gage_summaries), None if it has none.
+    """
+    bbox, geometry = basin_geometry()
+    item_id = event_item_id(event, realization)
+
+    item = pystac.Item(id=item_id, geometry=geometry, bbox=bbox, datetime=datetime.datetime.now(), properties={})
+
+    item.properties["metadata_version"] = "Experimental"
+
+    item.validate()
+    ras_model_summary = {}
+    storm_summary = {}
+
+    for result in results:
+        if result["ras_model_summary"] is not None:
+            ras_model_summary[result["file_name"]] = result["ras_model_summary"]
+        if result["storm_summary"] is not None:
+            storm_summary = result["storm_summary"]
+        item.add_asset(result["file_name"], result["asset"])
+
+    # item.add_asset(
+    #     "compute-graph",
+    #     pystac.Asset(
+    #         href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/compute-graph.png",
+    #         media_type=pystac.MediaType.PNG,
+    #         roles=["Thumbnail"],
+    #     ),
+    # )
+
+    # item.add_asset(
+    #     "transposed-storm",
+    #     pystac.Asset(
+    #         href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/transpo.png",
+    #         media_type=pystac.MediaType.PNG,
+    #         roles=["Thumbnail"],
+    #     ),
+    # )
+
+    item.add_links(SHARED_LINKS)
+
+    item.properties["HEC_HMS:summary"] = "Unavailable"
+    item.properties["HEC_ResSIM:summary"] = "Unavailable"
+
+    # item.properties["HEC_RAS:model_failures"] = randint(0, 5)
+    item.properties["HEC_RAS:levee_breaches"] = "Unavailable"
+    item.properties["HEC_RAS:model_summary"] = ras_model_summary
+    item.properties["FFRD:realization"] = realization
+    item.properties["FFRD:block_group"] = block_group
+    item.properties["FFRD:event"] = event
+
+    for k, v in storm_summary.items():
+        if k == "storm_identification_image":
+            item.add_asset(
+                "storm_identification_image",
+                pystac.Asset(
+                    href=v,
+                    media_type=pystac.MediaType.PNG,
+                    roles=["Thumbnail"],
+                ),
+            )
+        else:
+            item.properties[f"FFRD:{k}"] = v
+
+    gage_summary = compact_item(item) if compact else None
+    item.properties[CONTENT_HASH_PROPERTY] = item_hash(item)
+    return item, gage_summary
+
+
+def pop_gage_summaries(item: pystac.Item) -> pa.Table:
+    """Remove the reference summaries (nested or columnar) from the HDF assets of an item, as one GAGE_SUMMARY table."""
+    columns = {field.name: [] for field in GAGE_SUMMARY_SCHEMA}
+    for asset in item.assets.values():
+        summary = asset.extra_fields.pop("hec_ras:reference_summary_output", None)
+        if not isinstance(summary, dict):
+            continue
+        if isinstance(summary.get("gage"), list):
+            rows = (dict(zip(summary, values)) for values in zip(*summary.values()))
+        else:
+            rows = (
+                {"mesh_name": mesh, "gage": gage, **data}
+                for mesh, gages in summary.items()
+                for gage, data in gages.items()
+            )
+        ras_model = Path(asset.href).name[:-8]
+        for row in rows:
+            row["ras_model"] = ras_model
+            for name, column in columns.items():
+                column.append(row.get(name))
+    return pa.Table.from_pydict(columns, schema=GAGE_SUMMARY_SCHEMA)
+
+
+def gage_summary_key(item_id: str) -> str:
+    return f"{GAGE_SUMMARY_PREFIX}/{item_id}.parquet"
+
+
+def write_gage_summary(item_id: str, body: bytes) -> str:
+    """Write the gage summary parquet of an item (see compact_item) to S3, returning its href."""
+    _thread_s3_client().put_object(Bucket=BUCKET_NAME, Key=gage_summary_key(item_id), Body=body)
+    return f"s3://{BUCKET_NAME}/{gage_summary_key(item_id)}"
+
+
+def write_gage_summaries(builds: list, executor: ThreadPoolExecutor = None) -> dict:
+    """
+    Write the gage summary sidecars of a batch of iter_event_items builds, before their items are upserted.
+
+    The sidecars are written by the threads of executor, which should last the whole run so that the S3 client of
+    each thread is reused from batch to batch (they are written by the calling thread without one).
+
+    Returns
+    -------
+        dict: {item id: error} of the sidecars that could not be written.
+    """
+
+    def write(build):
+        try:
+            write_gage_summary(build["item"].id, build["gage_summary"])
+        except Exception as e:
+            logging.error(f"{build['item'].id}: Failed to write gage summary {e}")
+            return build["item"].id, str(e)
+        return build["item"].id, None
+
+    pending = [build for build in builds if build.get("gage_summary") is not None]
+    results = executor.map(write, pending) if executor is not None else map(write, pending)
+    return {item_id: error for item_id, error in results if error is not None}
+
+
+def compact_item(item: pystac.Item) -> bytes:
+    """
+    Move the parts repeated in every event item (or only read by the ETL) out of the item JSON, in place:
+
+    - the shared model and viewer links are removed, they are added to the collection instead (see add_shared_context)
+    - the basin geometry is replaced by the polygon of its bbox, the full geometry is a collection asset
+    - the reference summaries of the HDF assets are moved to a gage summary parquet asset, read by etl/stac_to_pqs.py
+
+    The sidecar is not written here but returned, so it is only written for items that are upserted (see
+    write_gage_summaries). Its checksum is part of the asset, so the item hash changes with the gage summaries.
+
+    Returns
+    -------
+        bytes: The gage summary parquet to write at the href of the gage summary asset, None if the item has no
+        reference summaries.
+    """
+    for rel in {link.rel for link in SHARED_LINKS}:
+        item.remove_links(rel)
+
+    xmin, ymin, xmax, ymax = item.bbox
+    item.geometry = {
+        "type": "Polygon",
+        "coordinates": [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]],
+    }
+
+    table = pop_gage_summaries(item)
+    if not table.num_rows:
+        return None
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer, compression="zstd")
+    body = buffer.getvalue().to_pybytes()
+    item.add_asset(
+        GAGE_SUMMARY_ASSET,
+        pystac.Asset(
+            href=f"s3://{BUCKET_NAME}/{gage_summary_key(item.id)}",
+            media_type="application/vnd.apache.parquet",
+            roles=["data", GAGE_SUMMARY_ASSET],
+            extra_fields={
+                "table:row_count": table.num_rows,
+                # sha2-256 multihash (file extension)
+                "file:checksum": f"1220{hashlib.sha256(body).hexdigest()}",
+            },
+        ),
+    )
+    return body
+
+
+def add_shared_context(collection: pystac.Collection) -> bool:
+    """
+    Add the links and basin geometry left out of compact items to their collection, unless it already has them.
+    Returns whether the collection was changed.
+    """
+    if "basin-geometry" in collection.assets:
+        return False
+    collection.add_links(SHARED_LINKS)
+    collection.add_asset(
+        "basin-geometry",
+        pystac.Asset(
+            href=KANAWHA_BASIN_SIMPLE_GEOMETRY,
+            media_type="application/geopackage+sqlite3",
+            roles=["data", "geometry"],
+            title="Kanawha basin (simplified), the geometry of every event item",
+        ),
+    )
+    return True
+
+
+def update_shared_context(stac_api_url: str, collection_id: str):
+    """
+    Add the shared context of compact items (see add_shared_context) to a collection of the API built without it, e.g.
+    when block group 1 (which creates the collection) is not rebuilt by a resumed or sharded build.
+    """
+    response = collection_exists(stac_api_url, collection_id)
+    if response.status_code != 200:
+        logging.warning(f"Collection {collection_id} not found, not adding the shared context of compact items")
+        return
+    collection = pystac.Collection.from_dict(response.json())
+    if add_shared_context(collection):
+        logging.info(f"Adding the shared context of compact items to collection {collection_id}")
+        upsert_collection(stac_api_url, collection, headers={})
+
+
+def compare_item_payloads(items: list, repeat: int = 20) -> dict:
+    """
+    Compare the JSON payloads of full and compact (see compact_item) versions of built items: mean size in bytes and
+    mean time to serialize and parse them back into a pystac.Item (as the API, the ETL and the client each do).
+    """
+
+    def measure(item_dicts):
+        sizes, start = [], time.perf_counter()
+        for _ in range(repeat):
+            for item_dict in item_dicts:
+                payload = json.dumps(item_dict)
+                pystac.Item.from_dict(json.loads(payload))
+                sizes.append(len(payload))
+        return {
+            "bytes": round(sum(sizes) / len(sizes)),
+            "ms": round((time.perf_counter() - start) * 1000 / len(sizes), 3),
+        }
+
+    full = [item.to_dict(include_self_link=False, transform_hrefs=False) for item in items]
+    compact = []
+    for item in items:
+        compacted = item.clone()
+        compact_item(compacted)
+        compact.append(compacted.to_dict(include_self_link=False, transform_hrefs=False))
+    report = {"full": measure(full), "compact": measure(compact)}
+    report["size_ratio"] = round(report["compact"]["bytes"] / report["full"]["bytes"], 3)
+    return report
+
+
+def iter_event_items(
+    events,
+    realization: int = REALZIATION,
+    max_workers: int = HARVEST_WORKERS,
+    retries: int = HARVEST_RETRIES,
+    manifest: BuildManifest = None,
+    hdf_pool: ProcessPoolExecutor = None,
+    max_in_flight: int = MAX_IN_FLIGHT_EVENTS,
+):
+    """
+    Build the items of (block_group, event) pairs, harvesting up to max_in_flight events concurrently.
+
+    The assets of all in-flight events share a pool of max_workers threads doing the S3 I/O; plan HDFs are summarized
+    in hdf_pool when given, the threads only submitting them, so all the HDFs of the in-flight events can be summarized
+    at once whatever max_workers. Events are yielded in order as soon as they are harvested, so only max_in_flight events are
+    ever held in memory, whatever the number of events.
+
+    Events are listed max_in_flight at a time, and the storm files (.met) of each window are read and their historic
+    storms resolved together (see storms_to_stac_metadata) before its assets are harvested.
+
+    Asset metadata (size, ETag, last modified, storage tier) comes from the ListObjectsV2 pages of the event prefix,
+    so no per-object HEAD request is made. Assets are added to the item in listing order regardless of completion
+    order, so the item is the same as the one built serially (max_workers=1).
+
+    Yields
+    ------
+        dict: block_group, event, event_prefix, objects (the event listing), item, gage_summary (the sidecar of compact
+        items, see compact_item), changed and harvest_errors. With a manifest, events whose S3 contents are unchanged
+        since the last build are not harvested (item is None), and
+        changed is False for rebuilt items identical to the last emitted item. Recording the events in the manifest is
+        left to the caller, which must not record events with harvest_errors (assets whose summary could not be
+        extracted) so that the next build harvests them again.
+    """
+    client = _thread_s3_client()
+    region = client.meta.region_name
+    latencies = []
+    harvest_start = time.perf_counter()
+    in_flight = deque()
+
+    def list_event(block_group, event) -> tuple:
+        """The build of an event and whether it is unchanged since the last build (and is not harvested)."""
+        event_prefix = event_output_prefix(event)
+        event_objects = list(list_objects(client, BUCKET_NAME, event_prefix))
+        build = {"block_group": block_group, "event": event, "event_prefix": event_prefix, "objects": event_objects}
+        unchanged = manifest is not None and manifest.event_unchanged(event_prefix, objects_fingerprint(event_objects))
+        return build, unchanged
+
+    def resolve_storms(window) -> dict:
+        """Storm summaries of the .met files of the events of a window to harvest, by s3 uri."""
+        storm_files = [
+            f"s3://{BUCKET_NAME}/{obj['Key']}"
+            for build, unchanged in window
+            if not unchanged
+            for obj in build["objects"]
+            if obj["Key"].endswith(".met")
+        ]
+        return storms_to_stac_metadata(client, storm_files) if storm_files else {}
+
+    def submit(executor, build, unchanged, storm_summaries):
+        block_group, event_prefix, event_objects = build["block_group"], build["event_prefix"], build["objects"]
+        if unchanged:
+            logging.info(f"Block Group {block_group} | Event {event_prefix}: unchanged, skipping")
+            in_flight.append((build, None, None))
+            return
+
+        logging.info(f"Block Group {block_group} | Event {event_prefix}: processing {len(event_objects)} Assets")
+        futures = [
+            executor.submit(
+                harvest_asset,
+                obj,
+                region,
+                retries=retries,
+                hdf_pool=hdf_pool,
+                storm_summary=storm_summaries.get(f"s3://{BUCKET_NAME}/{obj['Key']}"),
+            )
+            for obj in event_objects
+        ]
+        in_flight.append((build, futures, time.perf_counter()))
+
+    def finish() -> dict:
+        build, futures, event_start = in_flight.popleft()
+        if futures is None:
+            return {**build, "item": None, "gage_summary": None, "changed": False, "harvest_errors": 0}
+
+        # futures are in key order, keeping asset order (and summaries) deterministic
+        results = [add_hdf_summary(future.result()) for future in futures]
+        event_latencies = [result["latency"] for result in results]
+        logging.info(
+            f"Block Group {build['block_group']} | Event {build['event_prefix']}: "
+            f"{throughput_report(event_latencies, time.perf_counter() - event_start)}"
+        )
+        latencies.extend(event_latencies)
+
+        item, gage_summary = build_event_item(build["event"], build["block_group"], realization, results)
+        harvest_errors = sum(result["error"] for result in results)
+        changed = manifest is None or harvest_errors > 0 or not manifest.item_unchanged(build["event_prefix"], item)
+        if harvest_errors:
+            logging.warning(
+                f"Block Group {build['block_group']} | Event {build['event_prefix']}: {harvest_errors} assets failed, "
+                "the event will be harvested again by the next build"
+            )
+        elif not changed:
+            logging.info(
+                f"Block Group {build['block_group']} | Event {build['event_prefix']}: item unchanged, skipping upsert"
             )
+        return {
+            **build,
+            "item": item,
+            "gage_summary": gage_summary,
+            "changed": changed,
+            "harvest_errors": harvest_errors,
+        }
+
+    events = iter(events)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while window := [list_event(block_group, event) for block_group, event in islice(events, max_in_flight)]:
+            storm_summaries = resolve_storms(window)
+            for build, unchanged in window:
+                submit(executor, build, unchanged, storm_summaries)
+                if len(in_flight) >= max_in_flight:
+                    yield finish()
+        while in_flight:
+            yield finish()
+
+    logging.info(
+        f"Realization {realization} | workers={max_workers}: "
+        f"{throughput_report(latencies, time.perf_counter() - harvest_start)}"
+    )
+    logging.info(f"Realization {realization} | storm lookups: {get_storm_lookup().stats()}")
+
+
+def main(
+    event_ids: list,
+    block_group: int,
+    realization: int = REALZIATION,
+    max_workers: int = HARVEST_WORKERS,
+    retries: int = HARVEST_RETRIES,
+    manifest: BuildManifest = None,
+    hdf_pool: ProcessPoolExecutor = None,
+):
+    """
+    Build one STAC item per event of a block group (see iter_event_items).
+
+    When a manifest is given, events whose S3 contents are unchanged since the last build are not harvested, and
+    rebuilt items identical to the last emitted item are recorded but not returned for upsert. Events with harvest
+    errors are returned for upsert but not recorded.
+
+    Returns
+    -------
+        tuple: The builds (see iter_event_items) of the items to upsert (see upsert_builds), and the number of events
+        with harvest errors.
+    """
+    event_builds = []
+    harvest_failed = 0
+    for build in iter_event_items(
+        ((block_group, event) for event in event_ids),
+        realization=realization,
+        max_workers=max_workers,
+        retries=retries,
+        manifest=manifest,
+        hdf_pool=hdf_pool,
+    ):
+        if build["item"] is None:
+            continue
+        if build["harvest_errors"]:
+            harvest_failed += 1
+        elif manifest is not None:
+            manifest.record_event(build["event_prefix"], build["objects"], build["item"])
+        if build["changed"]:
+            event_builds.append(build)
+    return event_builds, harvest_failed
+
+
+def upsert_realization(
+    stac_api_url: str,
+    collection_id: str,
+    block_groups: dict,
+    manifest: BuildManifest,
+    session,
+    hdf_pool: ProcessPoolExecutor = None,
+    realization: int = REALZIATION,
+    remote_hashes: dict = None,
+    exporter: GeoParquetWriter = None,
+    sidecar_executor: ThreadPoolExecutor = None,
+):
+    """
+    Harvest the events of several block groups ({block_group: event_ids}) as one stream, upserting the items in
+    batches of UPSERT_BATCH_SIZE while the next events are harvested. With remote_hashes (see
+    utils.list_item_hashes), only the items that differ from the API are sent (see upsert_builds). With an exporter,
+    every item built (changed or not) is also added to it. The gage summary sidecars are written by sidecar_executor
+    (see write_gage_summaries).
 
-            item.add_asset(file_name, asset)
-
-        # item.add_asset(
-        #     "compute-graph",
-        #     pystac.Asset(
-        #         href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/compute-graph.png",
-        #         media_type=pystac.MediaType.PNG,
-        #         roles=["Thumbnail"],
-        #     ),
-        # )
-
-        # item.add_asset(
-        #     "transposed-storm",
-        #     pystac.Asset(
-        #         href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/transpo.png",
-        #         media_type=pystac.MediaType.PNG,
-        #         roles=["Thumbnail"],
-        #     ),
-        # )
-
-        item.add_links([*ras_links, *hms_links, *ressim_links, *storm_view_links])
-
-        item.properties["HEC_HMS:summary"] = "Unavailable"
-        item.properties["HEC_ResSIM:summary"] = "Unavailable"
-
-        # item.properties["HEC_RAS:model_failures"] = randint(0, 5)
-        item.properties["HEC_RAS:levee_breaches"] = "Unavailable"
-        item.properties["HEC_RAS:model_summary"] = ras_model_summary
-        item.properties["FFRD:realization"] = REALZIATION
-        item.properties["FFRD:block_group"] = block_group
-        item.properties["FFRD:event"] = event
-
-        for k, v in storm_summary.items():
-            if k == "storm_identification_image":
-                item.add_asset(
-                    "storm_identification_image",
-                    pystac.Asset(
-                        href=v,
-                        media_type=pystac.MediaType.PNG,
-                        roles=["Thumbnail"],
-                    ),
+    At most MAX_IN_FLIGHT_EVENTS events are harvested and MAX_IN_FLIGHT_UPSERTS batches upserted at a time, so memory
+    stays bounded for a full realization. Events are recorded (and committed) in the manifest once their item is
+    upserted, and a block group is marked complete when all of its items are.
+    """
+    remaining = {block_group: len(event_ids) for block_group, event_ids in block_groups.items()}
+    failed = set()
+    batch = []
+    upserts = set()
+    for block_group, count in remaining.items():
+        if count == 0:
+            manifest.mark_block_group_complete(collection_id, realization, block_group)
+
+    def upserted(future):
+        builds, results = future.result()
+        failed_ids = {result["id"] for result in results if result["action"] == "failed"}
+        for build in builds:
+            if build["item"].id in failed_ids or build["harvest_errors"]:
+                # leave the event unrecorded (and its block group incomplete) so the next run retries it
+                failed.add(build["block_group"])
+            else:
+                manifest.record_event(build["event_prefix"], build["objects"], build["item"])
+        manifest.commit()
+        for build in builds:
+            complete(build["block_group"])
+
+    def complete(block_group):
+        remaining[block_group] -= 1
+        if remaining[block_group] == 0 and block_group not in failed:
+            manifest.mark_block_group_complete(collection_id, realization, block_group)
+            logging.info(f"Block Group {block_group}: complete")
+
+    def flush(upsert_executor):
+        nonlocal batch
+        if batch:
+            upserts.add(
+                upsert_executor.submit(
+                    upsert_builds, stac_api_url, collection_id, batch, session, remote_hashes, sidecar_executor
                 )
+            )
+            batch = []
+        while len(upserts) > MAX_IN_FLIGHT_UPSERTS:
+            done, _ = wait(upserts, return_when=FIRST_COMPLETED)
+            for future in done:
+                upserts.remove(future)
+                upserted(future)
+
+    events = ((block_group, event) for block_group, event_ids in block_groups.items() for event in event_ids)
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT_UPSERTS) as upsert_executor:
+        for build in iter_event_items(events, realization=realization, manifest=manifest, hdf_pool=hdf_pool):
+            if exporter is not None and build["item"] is not None:
+                exporter.add(build["item"])
+            if build["item"] is None:
+                complete(build["block_group"])
+            elif not build["changed"]:
+                manifest.record_event(build["event_prefix"], build["objects"], build["item"])
+                complete(build["block_group"])
             else:
-                item.properties[f"FFRD:{k}"] = v
+                batch.append(build)
+                if len(batch) >= UPSERT_BATCH_SIZE:
+                    flush(upsert_executor)
+        flush(upsert_executor)
+        for future in list(upserts):
+            upserts.remove(future)
+            upserted(future)
+    manifest.commit()
+
+
+def wait_for_collection(
+    stac_api_url: str, collection_id: str, timeout: float = COLLECTION_WAIT_S, interval: float = 30
+):
+    """Wait until the collection exists in the STAC API (created by shard 0), raising TimeoutError after timeout."""
+    deadline = time.monotonic() + timeout
+    while collection_exists(stac_api_url, collection_id).status_code != 200:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Collection {collection_id} not created after {timeout}s")
+        logging.info(f"Waiting for collection {collection_id}")
+        time.sleep(interval)
+
 
-        event_items.append(item)
-    return event_items
+def upsert_builds(
+    stac_api_url: str,
+    collection_id: str,
+    builds: list,
+    session,
+    remote_hashes: dict = None,
+    sidecar_executor: ThreadPoolExecutor = None,
+) -> tuple:
+    """
+    Upsert the items of a batch of iter_event_items builds, returning the builds and the upsert results.
+
+    With remote_hashes, the items are synced instead (see utils.sync_items): only new items are POSTed and changed
+    items PUT. The gage summary sidecars of the items sent are written first (see write_gage_summaries), items whose
+    sidecar could not be written are not sent and reported as failed.
+    """
+    if remote_hashes is not None:
+        # the sidecar of an item unchanged in the API is unchanged too (its checksum is part of the item hash)
+        sent = [
+            build
+            for build in builds
+            if remote_hashes.get(build["item"].id) != build["item"].properties[CONTENT_HASH_PROPERTY]
+        ]
+    else:
+        sent = builds
+    failed = write_gage_summaries(sent, sidecar_executor)
+    items = [build["item"] for build in builds if build["item"].id not in failed]
+    failures = [
+        {"id": item_id, "status": None, "action": "failed", "error": error} for item_id, error in failed.items()
+    ]
+
+    if remote_hashes is not None:
+        results = sync_items(
+            stac_api_url,
+            collection_id,
+            items,
+            remote_hashes,
+            CONTENT_HASH_PROPERTY,
+            headers={},
+            max_workers=UPSERT_WORKERS,
+            session=session,
+        )
+        return builds, results + failures
+
+    results = bulk_upsert_items(
+        stac_api_url,
+        collection_id,
+        items,
+        headers={},
+        batch_size=UPSERT_BATCH_SIZE,
+        max_workers=UPSERT_WORKERS,
+        session=session,
+    )
+    return builds, results + failures
+
+
+def sync_report(
+    block_groups: dict,
+    remote_hashes: dict,
+    manifest: BuildManifest = None,
+    hdf_pool: ProcessPoolExecutor = None,
+    realization: int = REALZIATION,
+) -> dict:
+    """
+    Dry run of a sync: build the items of the block groups ({block_group: event_ids}) and compare them with the API,
+    without upserting or recording anything.
+
+    Events unchanged since the last build (per the manifest) are not harvested, their recorded item hash is compared
+    instead.
+
+    Returns
+    -------
+        dict: The ids of the items to create, update and leave unchanged.
+    """
+    report = {"create": [], "update": [], "unchanged": []}
+    events = ((block_group, event) for block_group, event_ids in block_groups.items() for event in event_ids)
+    for build in iter_event_items(events, realization=realization, manifest=manifest, hdf_pool=hdf_pool):
+        if build["item"] is not None:
+            item_id, content_hash = build["item"].id, build["item"].properties[CONTENT_HASH_PROPERTY]
+        else:
+            item_id, content_hash = manifest.recorded_item(build["event_prefix"])
+        if item_id not in remote_hashes:
+            report["create"].append(item_id)
+        elif remote_hashes[item_id] is None or remote_hashes[item_id] != content_hash:
+            report["update"].append(item_id)
+        else:
+            report["unchanged"].append(item_id)
+    return report
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and upsert the event items of a realization.")
+    parser.add_argument(
+        "--manifest",
+        default=f"{COLLECTION_ID}-manifest.sqlite",
+        help="SQLite manifest used to skip unchanged events between runs",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="skip block groups completed by a previous (interrupted) run"
+    )
+    parser.add_argument("--hdf-workers", type=int, default=HDF_WORKERS, help="processes parsing plan HDFs")
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="i/N: build only the block groups of shard i of N (see shard_plan.py), with a manifest per shard",
+    )
+    parser.add_argument(
+        "--plan",
+        default=f"{COLLECTION_ID}-shard-plan.json",
+        help="shard plan shared by all the shards of a build, written beforehand with `shard_plan.py plan N`",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="compare the built items with the API by content hash and only send new and changed items",
+    )
+    parser.add_argument(
+        "--delete-orphans",
+        action="store_true",
+        help="with --sync, delete the items of the collection not produced by any event of the realization",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="with --sync, report the items to create, update and delete and exit"
+    )
+    parser.add_argument("--report", default=None, help="JSON file the --dry-run report is written to")
+    parser.add_argument(
+        "--geoparquet",
+        default=None,
+        help="also write the items built by this run to a geoparquet file (see collection_geoparquet.py). Events "
+        "skipped as unchanged by the manifest are left out, use a fresh --manifest (or `collection_geoparquet.py "
+        "export`) for a whole collection. Not with --resume or --shard",
+    )
+    args = parser.parse_args()
+    if (args.dry_run or args.delete_orphans) and not args.sync:
+        # without the API's item hashes every item would be reported as new and no orphan could be found
+        parser.error("--dry-run and --delete-orphans need --sync")
+    if args.geoparquet and (args.resume or args.shard is not None):
+        # the file would only hold part of the realization
+        parser.error("--geoparquet needs a full (unsharded, not resumed) build")
+    if args.shard is not None and not os.path.exists(args.plan):
+        # shards planning on their own could list different events and skip or duplicate block groups
+        parser.error(f"--shard needs the shard plan {args.plan}, write it with `shard_plan.py plan {args.shard[1]}`")
+
     collection_id = COLLECTION_ID
     stac_api_url = os.getenv("STAC_API_URL")
+    # start the HDF workers before the S3 and HTTP clients
+    hdf_pool = init_hdf_pool(args.hdf_workers)
     _, client, resource = init_s3_resources()
+    stac_session = init_stac_session(pool_size=UPSERT_WORKERS)
+
+    manifest_path = args.manifest
+    if args.shard is not None:
+        manifest_path = shard_manifest_path(args.manifest, *args.shard)
+        if not os.path.exists(manifest_path) and os.path.exists(args.manifest):
+            # start from the merged manifest of the previous build, to skip the events unchanged since the last build
+            shutil.copyfile(args.manifest, manifest_path)
+    manifest = BuildManifest(manifest_path)
+    if not args.resume and not args.dry_run:
+        manifest.reset_block_groups(collection_id, REALZIATION)
 
     sim_records = json.loads(str_from_s3(BLOCK_FILE_KEY, client, BUCKET_NAME))
+    block_groups = realization_block_groups(sim_records, REALZIATION)
+    expected_ids = {event_item_id(event) for event_ids in block_groups.values() for event in event_ids}
 
-    for record in sim_records:
-        if record["realization_index"] == 1:
-            block_group = record["block_index"]
-            block_events = range(record["block_event_start"], record["block_event_end"] + 1)
-            if block_group == 1:
-                logging.info(block_group, list(block_events))
-                event_items = main(list(block_events), block_group)
-                # WARNING: delete collection as needed to update for testing
-                # delete_collection(stac_api_url, collection_id, headers={})
-                collection = create_collection(
-                    event_items,
-                    collection_id,
-                    description="This is a sandbox collection for testing purposes",
-                    title="sandbox",
-                )
-                collection.add_asset(
-                    "compute-graph",
-                    pystac.Asset(
-                        href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/compute-graph.png",
-                        media_type=pystac.MediaType.PNG,
-                        roles=["Thumbnail"],
-                    ),
-                )
-                upsert_collection(stac_api_url, collection, headers={})
-                for item in event_items:
-                    upsert_item(stac_api_url, collection_id, item, headers={})
-            else:
-                logging.info(block_group, list(block_events))
-                event_items = main(list(block_events), block_group)
-                for item in event_items:
-                    upsert_item(stac_api_url, collection_id, item, headers={})
+    if args.shard is not None:
+        shard, shards = args.shard
+        plan = read_plan(args.plan)
+        if len(plan) != shards:
+            raise ValueError(f"{args.plan} has {len(plan)} shards, not {shards}")
+        block_groups = plan[shard]["block_groups"]
+        logging.info(
+            f"Shard {shard}/{shards}: {len(block_groups)} block groups, {plan[shard]['events']} events, "
+            f"{plan[shard]['hdfs']} HDFs"
+        )
+
+    for block_group in list(block_groups):
+        if args.resume and manifest.block_group_complete(collection_id, REALZIATION, block_group):
+            logging.info(f"Block Group {block_group}: completed by a previous run, skipping")
+            del block_groups[block_group]
+
+    remote_hashes = None
+    orphans = []
+    if args.sync:
+        remote_hashes = (
+            list_item_hashes(stac_api_url, collection_id, CONTENT_HASH_PROPERTY, session=stac_session)
+            if collection_exists(stac_api_url, collection_id).status_code == 200
+            else {}
+        )
+        # every shard sees the whole realization, leave the deletes to shard 0
+        if args.delete_orphans and (args.shard is None or args.shard[0] == 0):
+            orphans = sorted(set(remote_hashes) - expected_ids)
+        logging.info(f"{collection_id}: {len(remote_hashes)} items in the API, {len(orphans)} orphans")
+
+        if not args.dry_run:
+            # events skipped as unchanged since the last build must still be rebuilt if their item differs in the API
+            stale = []
+            for event in (event for event_ids in block_groups.values() for event in event_ids):
+                item_id, content_hash = manifest.recorded_item(event_output_prefix(event))
+                if item_id is not None and remote_hashes.get(item_id) != content_hash:
+                    stale.append(event_output_prefix(event))
+            if stale:
+                logging.info(f"{len(stale)} recorded events differ from the API, rebuilding them")
+                manifest.forget_events(stale)
+
+    if args.dry_run:
+        report = {**sync_report(block_groups, remote_hashes or {}, manifest, hdf_pool), "delete": orphans}
+        logging.info(f"Dry run: {({action: len(ids) for action, ids in report.items()})}")
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+        hdf_pool.shutdown()
+        manifest.close()
+        raise SystemExit(0)
+
+    exporter = GeoParquetWriter(args.geoparquet) if args.geoparquet else None
+    # one pool for the whole run, so each of its threads keeps its S3 client (see write_gage_summaries)
+    sidecar_executor = ThreadPoolExecutor(max_workers=UPSERT_WORKERS, thread_name_prefix="gage-summary")
+
+    collection_upserted = False
+    if 1 in block_groups:
+        # the collection extent comes from the first block group, build it before streaming the others
+        event_builds, harvest_failed = main(block_groups.pop(1), 1, manifest=manifest, hdf_pool=hdf_pool)
+        event_items = [build["item"] for build in event_builds]
+        if exporter is not None:
+            for item in event_items:
+                exporter.add(item)
+        # WARNING: delete collection as needed to update for testing
+        # delete_collection(stac_api_url, collection_id, headers={})
+        # leave the collection alone when nothing was rebuilt
+        if event_items:
+            collection = create_collection(
+                event_items,
+                collection_id,
+                description="This is a sandbox collection for testing purposes",
+                title="sandbox",
+            )
+            collection.add_asset(
+                "compute-graph",
+                pystac.Asset(
+                    href=f"https://{BUCKET_NAME}.s3.amazonaws.com/stac/Kanawha-0505/compute-graph.png",
+                    media_type=pystac.MediaType.PNG,
+                    roles=["Thumbnail"],
+                ),
+            )
+            if COMPACT_ITEMS:
+                add_shared_context(collection)
+            upsert_collection(stac_api_url, collection, headers={})
+            collection_upserted = True
+
+        _, results = upsert_builds(
+            stac_api_url, collection_id, event_builds, stac_session, remote_hashes, sidecar_executor
+        )
+        if any(result["action"] == "failed" for result in results):
+            # leave the block group (and its manifest records) uncommitted so the next run retries it
+            manifest.discard_pending()
+        elif harvest_failed:
+            # events with harvest errors were left unrecorded, keep the block group incomplete so they are retried
+            manifest.commit()
+        else:
+            manifest.mark_block_group_complete(collection_id, REALZIATION, 1)
+    elif args.shard is not None and block_groups:
+        wait_for_collection(stac_api_url, collection_id)
+
+    if COMPACT_ITEMS and not collection_upserted and (args.shard is None or args.shard[0] == 0):
+        # block group 1 (always on shard 0) was not rebuilt, e.g. resumed or unchanged, the collection may predate
+        # compact items
+        update_shared_context(stac_api_url, collection_id)
+
+    upsert_realization(
+        stac_api_url,
+        collection_id,
+        block_groups,
+        manifest,
+        stac_session,
+        hdf_pool=hdf_pool,
+        remote_hashes=remote_hashes,
+        exporter=exporter,
+        sidecar_executor=sidecar_executor,
+    )
+    sidecar_executor.shutdown()
+    if exporter is not None and exporter.close() < len(expected_ids):
+        logging.warning(
+            f"{args.geoparquet} holds {exporter.written} of the {len(expected_ids)} items of the realization, the "
+            "others were unchanged since the manifest's last build or failed"
+        )
+
+    if orphans:
+        results = delete_items(stac_api_url, collection_id, orphans, headers={}, session=stac_session)
+        logging.info(f"Deleted {sum(result['action'] == 'deleted' for result in results)} orphan items")
+
+    hdf_pool.shutdown()
+    manifest.close()
@@ -0,0 +1,191 @@
+"""
+Split the block groups of a realization into shards of similar cost, so a collection build can run on several nodes
+(`new_collection.py --shard i/N`), each with its own manifest, merged with `merge` once all shards are done.
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from manifest import BuildManifest
+from utils import init_s3_resources, list_objects, str_from_s3
+
+# Cost of harvesting a plan HDF (one open and summary parse) in bytes of plain object harvest, on top of its size
+HDF_COST_BYTES = int(os.getenv("HDF_COST_BYTES", 256 * 2**20))
+# Concurrent event prefix listings while sizing a realization
+LISTING_WORKERS = int(os.getenv("LISTING_WORKERS", 32))
+
+
+def parse_shard(shard: str) -> tuple:
+    """Parse an `i/N` shard argument (0 <= i < N) into (i, N)."""
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must be i/N, got {shard!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def realization_block_groups(sim_records: list, realization: int) -> dict:
+    """{block_group: event ids} of a realization, from the records of the blockfile."""
+    block_groups = {}
+    for record in sim_records:
+        if record["realization_index"] == realization:
+            block_groups[record["block_index"]] = list(
+                range(record["block_event_start"], record["block_event_end"] + 1)
+            )
+    return block_groups
+
+
+def event_sizes(client, bucket: str, output_prefix: str, events: list, max_workers: int = LISTING_WORKERS) -> dict:
+    """{event: {"bytes": total object size, "hdfs": number of plan HDFs}}, from a listing of each event prefix."""
+
+    def size(event):
+        sizes = {"bytes": 0, "hdfs": 0}
+        for obj in list_objects(client, bucket, f"{output_prefix}/{event}/"):
+            sizes["bytes"] += obj["Size"]
+            sizes["hdfs"] += obj["Key"].endswith(".hdf")
+        return event, sizes
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(size, events))
+
+
+def event_cost(sizes: dict, hdf_cost_bytes: int = HDF_COST_BYTES) -> int:
+    return sizes["bytes"] + sizes["hdfs"] * hdf_cost_bytes
+
+
+def plan_shards(block_groups: dict, sizes: dict, shards: int, hdf_cost_bytes: int = HDF_COST_BYTES) -> list:
+    """
+    Assign whole block groups to shards, balancing the estimated cost of their events (see event_cost).
+
+    Block groups are assigned from the most to the least expensive, each to the least loaded shard (ties broken by
+    block group and shard index), so the plan only depends on its inputs and every node computes the same one. Block
+    group 1, which sets the collection extent, always goes to shard 0.
+
+    Returns
+    -------
+        list: One dict per shard with its block_groups ({block_group: event ids}), events, bytes, hdfs and cost.
+    """
+    plan = [{"block_groups": {}, "events": 0, "bytes": 0, "hdfs": 0, "cost": 0} for _ in range(shards)]
+    empty = {"bytes": 0, "hdfs": 0}
+
+    def group_cost(block_group):
+        return sum(event_cost(sizes.get(event, empty), hdf_cost_bytes) for event in block_groups[block_group])
+
+    costs = {block_group: group_cost(block_group) for block_group in block_groups}
+    order = sorted(costs, key=lambda block_group: (block_group != 1, -costs[block_group], block_group))
+    for block_group in order:
+        index = 0 if block_group == 1 else min(range(shards), key=lambda i: (plan[i]["cost"], i))
+        shard = plan[index]
+        events = block_groups[block_group]
+        shard["block_groups"][block_group] = events
+        shard["events"] += len(events)
+        shard["bytes"] += sum(sizes.get(event, empty)["bytes"] for event in events)
+        shard["hdfs"] += sum(sizes.get(event, empty)["hdfs"] for event in events)
+        shard["cost"] += costs[block_group]
+
+    for shard in plan:
+        shard["block_groups"] = dict(sorted(shard["block_groups"].items()))
+    return plan
+
+
+def write_plan(path: str, plan: list):
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=2)
+
+
+def read_plan(path: str) -> list:
+    """Read a plan written by write_plan (JSON keys back to int block groups)."""
+    with open(path) as f:
+        plan = json.load(f)
+    for shard in plan:
+        shard["block_groups"] = {int(block_group): events for block_group, events in shard["block_groups"].items()}
+    return plan
+
+
+def shard_manifest_path(manifest_path: str, index: int, count: int) -> str:
+    """Manifest of one shard, next to the manifest of the whole build (`R001-manifest.sqlite`)."""
+    root, ext = os.path.splitext(manifest_path)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+def merge_shard_manifests(manifest_path: str, count: int, collection_id: str, realization: int, plan: list = None):
+    """
+    Merge the manifests of the count shards of a build into the build manifest, logging the block groups of the plan
+    that their shard did not complete.
+
+    The block group checkpoints of the build manifest are replaced by those of the shards, and each block group of the
+    plan is checked in the manifest of the shard it was assigned to, so completions of an earlier build don't count.
+    """
+    if plan is not None and len(plan) != count:
+        raise ValueError(f"The plan has {len(plan)} shards, not {count}")
+
+    manifest = BuildManifest(manifest_path)
+    incomplete = []
+    try:
+        manifest.reset_block_groups(collection_id, realization)
+        for index in range(count):
+            path = shard_manifest_path(manifest_path, index, count)
+            assigned = plan[index]["block_groups"] if plan is not None else {}
+            if not os.path.exists(path):
+                logging.warning(f"Shard {index}/{count}: no manifest at {path}")
+                incomplete.extend(assigned)
+                continue
+            logging.info(f"Shard {index}/{count}: merged {manifest.merge(path)}")
+
+            shard_manifest = BuildManifest(path)
+            try:
+                incomplete.extend(
+                    block_group
+                    for block_group in assigned
+                    if not shard_manifest.block_group_complete(collection_id, realization, block_group)
+                )
+            finally:
+                shard_manifest.close()
+    finally:
+        manifest.close()
+
+    if plan is not None:
+        if incomplete:
+            logging.warning(f"Block groups not completed by their shard: {sorted(incomplete)}")
+        else:
+            logging.info(f"All {sum(len(shard['block_groups']) for shard in plan)} block groups complete")
+
+
+if __name__ == "__main__":
+    from new_collection import BLOCK_FILE_KEY, BUCKET_NAME, COLLECTION_ID, REALZIATION, SIMULATION_OUTPUT_PREFIX
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Plan or merge a collection build sharded over several nodes.")
+    parser.add_argument("--realization", type=int, default=REALZIATION)
+    parser.add_argument("--plan", default=f"{COLLECTION_ID}-shard-plan.json", help="plan file written or read")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="size the events of the realization and write a shard plan")
+    plan_parser.add_argument("shards", type=int, help="number of shards")
+    merge_parser = subparsers.add_parser("merge", help="merge the shard manifests into the build manifest")
+    merge_parser.add_argument("shards", type=int, help="number of shards")
+    merge_parser.add_argument("--manifest", default=f"{COLLECTION_ID}-manifest.sqlite")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        _, client, _ = init_s3_resources()
+        block_groups = realization_block_groups(
+            json.loads(str_from_s3(BLOCK_FILE_KEY, client, BUCKET_NAME)), args.realization
+        )
+        sizes = event_sizes(
+            client, BUCKET_NAME, SIMULATION_OUTPUT_PREFIX, [e for events in block_groups.values() for e in events]
+        )
+        plan = plan_shards(block_groups, sizes, args.shards)
+        write_plan(args.plan, plan)
+        for index, shard in enumerate(plan):
+            logging.info(
+                f"Shard {index}/{args.shards}: {len(shard['block_groups'])} block groups, {shard['events']} events, "
+                f"{shard['hdfs']} HDFs, {shard['bytes'] / 2**30:.1f} GiB"
+            )
+    else:
+        plan = read_plan(args.plan) if os.path.exists(args.plan) else None
+        merge_shard_manifests(args.manifest, args.shards, COLLECTION_ID, args.realization, plan)
@@ -1,14 +1,45 @@
 import json
 import logging
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
 
+import numpy as np
 import requests
 from pyproj import Transformer
-from utils import split_s3_key, str_from_s3
+from utils import init_http_session, split_s3_key
 
 STORM_SEARCH_URL = "https://storms.dewberryanalytics.com/meilisearch/indexes/events/search"
+STORM_MULTI_SEARCH_URL = "https://storms.dewberryanalytics.com/meilisearch/multi-search"
+STORM_INDEX = "events"
 WATERSHED = "Kanawha"
 SST_REGION_VERSION = "V01"
 
+# On-disk storm lookup cache shared by all runs, and storm searches per multi-search request
+STORM_CACHE_PATH = os.getenv("STORM_CACHE_PATH", "storm-cache.sqlite")
+STORM_SEARCH_BATCH_SIZE = int(os.getenv("STORM_SEARCH_BATCH_SIZE", 50))
+
+# Storm files (.met/.grid) read concurrently in bulk mode, and bytes per read of their S3 body
+STORM_READ_WORKERS = int(os.getenv("STORM_READ_WORKERS", 32))
+STORM_READ_CHUNK_SIZE = 8192
+
+STORM_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS storms (
+    watershed TEXT NOT NULL,
+    region_version TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    hit TEXT NOT NULL,
+    PRIMARY KEY (watershed, region_version, year, rank)
+);
+"""
+
 PROJECTION = """PROJCS["USA_Contiguous_Albers_Equal_Area_Conic_USGS_version",
 								GEOGCS["NAD83",
 									DATUM["North_American_Datum_1983",
@@ -35,114 +66,415 @@ PROJECTION = """PROJCS["USA_Contiguous_Albers_Equal_Area_Conic_USGS_version",
             """
 
 
+@lru_cache(maxsize=16)
+def get_transformer(source_crs: str, target_crs: str = "EPSG:4326") -> Transformer:
+    """
+    Transformer from source_crs (e.g. the PROJECTION WKT) to target_crs, built once per pair: parsing the WKT and
+    creating the PROJ pipeline costs far more than transforming a point. Transformers are safe to share between
+    threads.
+    """
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
 def convert_to_storm_center_epsg4326(x, y, wkt):
-    transformer = Transformer.from_crs(wkt, "EPSG:4326", always_xy=True)
-    x, y = transformer.transform(x, y)
+    x, y = get_transformer(wkt).transform(x, y)
     return f"POINT({y} {x})"
 
 
-# def get_storm_info(s3_uri):
-#     """FROM .grid file"""
-#     results = {}
-#     bucket_name, key = split_s3_key(s3_uri)
-#     data = str_from_s3(key, client, bucket_name).split("\n")
-#     storm_date_index = data.index("     Grid Type: Precipitation\r") - 1
-#     storm_info = data[storm_date_index].replace("Grid: ", "").replace("\r", "").split(" ")
-#     results["storm_date"] = storm_info[1]
-#     results["water_year_rank"] = int(storm_info[2].replace("Y", ""))
+def storm_centers_to_epsg4326(x, y, wkt: str = PROJECTION) -> tuple:
+    """
+    Reproject arrays of storm center coordinates with a single vectorized transform.
 
-#     for line in data:
-#         if "Storm Center X" in line:
-#             x = float(line.split(":")[1].strip().replace("\r", ""))
-#         elif "Storm Center Y" in line:
-#             y = float(line.split(":")[1].strip().replace("\r", ""))
+    Returns
+    -------
+        tuple: lat and lon arrays.
+    """
+    lon, lat = get_transformer(wkt).transform(np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64"))
+    return lat, lon
 
-#     if x and y:
-#         results["sst_storm_center"] = convert_to_storm_center_epsg4326(x, y, PROJECTION)
-#     else:
-#         print("No Storm center..")
-#     return results
 
+def storm_center_points(x, y, wkt: str = PROJECTION) -> list:
+    """convert_to_storm_center_epsg4326 for arrays of storm centers, as "POINT(lat lon)" strings."""
+    lat, lon = storm_centers_to_epsg4326(x, y, wkt)
+    return [f"POINT({point_lat} {point_lon})" for point_lat, point_lon in zip(lat.tolist(), lon.tolist())]
 
-def get_storm_info(s3_uri, client):
-    """FROM .met file"""
-    results = {}
+
+class StormInfo(NamedTuple):
+    """Storm grid and SST storm center (in PROJECTION coordinates) of a .met or .grid file."""
+
+    storm_date: str
+    water_year_rank: int
+    storm_center_x: float = None
+    storm_center_y: float = None
+
+    def to_dict(self) -> dict:
+        results = {"storm_date": self.storm_date, "water_year_rank": self.water_year_rank}
+        if self.storm_center_x is None or self.storm_center_y is None:
+            logging.warning("No Storm center..")
+        else:
+            results["sst_storm_center"] = convert_to_storm_center_epsg4326(
+                self.storm_center_x, self.storm_center_y, PROJECTION
+            )
+        return results
+
+
+def parse_storm_lines(lines: Iterable[str]) -> StormInfo:
+    """
+    Parse the storm grid name and storm center from the lines of a .met or .grid file, stopping at the first line
+    completing them.
+
+    The storm grid name ("<source> <storm date> Y<water year rank>") is the "Precip Grid Name" of a .met file, or the
+    "Grid" whose "Grid Type" is Precipitation in a .grid file.
+    """
+    grid_name = last_grid = x = y = None
+    for line in lines:
+        name, _, value = line.strip().partition(":")
+        if name == "Precip Grid Name":
+            grid_name = value
+        elif name == "Grid":
+            last_grid = value
+        elif name == "Grid Type" and value.strip() == "Precipitation":
+            grid_name = last_grid
+        elif name == "Storm Center X":
+            x = float(value)
+        elif name == "Storm Center Y":
+            y = float(value)
+        if grid_name is not None and x is not None and y is not None:
+            break
+
+    if grid_name is None:
+        raise ValueError("No storm grid name found")
+    storm_info = grid_name.split()
+    return StormInfo(storm_info[1], int(storm_info[2].replace("Y", "")), x, y)
+
+
+def iter_s3_lines(client, bucket: str, key: str, chunk_size: int = STORM_READ_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the lines of an S3 text object, reading the body chunk_size bytes at a time."""
+    body = client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        for line in body.iter_lines(chunk_size=chunk_size):
+            yield line.decode("utf-8")
+    finally:
+        # stops the download when the reader exits early
+        body.close()
+
+
+def read_storm_info(s3_uri: str, client) -> StormInfo:
+    """Stream a .met or .grid file from S3, reading only up to its storm grid name and storm center."""
     bucket_name, key = split_s3_key(s3_uri)
-    data = str_from_s3(key, client, bucket_name).split("\n")
-    for line in data:
-        if "     Precip Grid Name:" in line:
-            storm_info = line.split("Precip Grid Name:")[1].replace("\r", "").split(" ")
-            results["storm_date"] = storm_info[2]
-            results["water_year_rank"] = int(storm_info[3].replace("Y", ""))
-        elif "Storm Center X" in line:
-            x = float(line.split(":")[1].strip().replace("\r", ""))
-        elif "Storm Center Y" in line:
-            y = float(line.split(":")[1].strip().replace("\r", ""))
-
-    if x and y:
-        results["sst_storm_center"] = convert_to_storm_center_epsg4326(x, y, PROJECTION)
-    else:
-        logging.warning("No Storm center..")
-    return results
+    with closing(iter_s3_lines(client, bucket_name, key)) as lines:
+        return parse_storm_lines(lines)
 
 
-def storm_viewer_query(watershed_name: str, transposition_region_ver: str, year: int, water_year_rank: int):
-
-    query_params = {
-        "facets": [
-            "ranks.declustered_rank",
-            "stats.mean",
-            "start.calendar_year",
-            "start.water_year",
-            "start.season",
-            "duration",
-            "categories.lv10",
-            "categories.lv11",
-        ],
-        "filter": [
-            [f'categories.lv10="{watershed_name}"'],
-            [f'start.calendar_year="{year}"'],
-            f"ranks.declustered_rank>={water_year_rank}",
-            f"ranks.declustered_rank<={water_year_rank}",
-        ],
-        "sort": ["start.timestamp:asc"],
-    }
+def read_storm_infos(client, s3_uris: list, max_workers: int = STORM_READ_WORKERS) -> dict:
+    """
+    read_storm_info for many storm files in parallel (the client is shared by the threads).
+
+    Returns
+    -------
+        dict: The StormInfo of each s3 uri read, files that could not be read or parsed are logged and left out.
+    """
+
+    def read(s3_uri):
+        try:
+            return s3_uri, read_storm_info(s3_uri, client)
+        except Exception as e:
+            logging.error(f"{s3_uri}: {e}")
+            return s3_uri, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return {s3_uri: info for s3_uri, info in executor.map(read, s3_uris) if info is not None}
+
+
+def get_storm_info(s3_uri, client):
+    """
+    FROM .met or .grid file
+
+    The storm center of a single file is reprojected on its own, storms_to_stac_metadata reprojects the centers of
+    many files at once (see storm_center_points).
+    """
+    if Path(s3_uri).suffix not in (".met", ".grid"):
+        logging.warning(f"{s3_uri}: not a .met or .grid file")
+    return read_storm_info(s3_uri, client).to_dict()
+
+
+def storm_search_filter(watershed_name: str, year: int, water_year_rank: int) -> list:
+    return [
+        [f'categories.lv10="{watershed_name}"'],
+        [f'start.calendar_year="{year}"'],
+        f"ranks.declustered_rank>={water_year_rank}",
+        f"ranks.declustered_rank<={water_year_rank}",
+    ]
+
+
+class StormNotFoundError(ValueError):
+    """The storm catalog has no storm for a (watershed, region version, year, rank) key."""
+
+
+class StormLookup:
+    """
+    Memoized historic storm lookup, keyed by (watershed, transposition region version, year, declustered rank).
+
+    Many events share the same historic storm, so each storm is searched once: hits are kept in memory and in a SQLite
+    store (path) that survives runs. Unresolved keys are searched in batches with a Meilisearch multi-search (falling
+    back to single searches when the endpoint is not available), over a pooled session retrying 429 and 5xx responses.
+
+    Storms not found are only remembered for the lifetime of the lookup, so they are searched again by the next run.
+    Safe to share between threads. Each lookup is counted once in stats(): a key resolved by prefetch is counted there
+    (as a memory or disk hit or a remote lookup), not again by the get() that follows it.
+    """
+
+    def __init__(
+        self,
+        path: str = STORM_CACHE_PATH,
+        session: requests.Session = None,
+        search_url: str = STORM_SEARCH_URL,
+        multi_search_url: str = STORM_MULTI_SEARCH_URL,
+        batch_size: int = STORM_SEARCH_BATCH_SIZE,
+    ):
+        self.session = session or init_http_session()
+        self.search_url = search_url
+        self.multi_search_url = multi_search_url
+        self.batch_size = batch_size
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.remote_lookups = 0
+        self.remote_requests = 0
+        self._storms = {}
+        self._prefetched = set()
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(STORM_CACHE_SCHEMA)
+        self.conn.commit()
+
+    @staticmethod
+    def key(watershed_name: str, transposition_region_ver: str, year, water_year_rank) -> tuple:
+        return (watershed_name, transposition_region_ver, int(year), int(water_year_rank))
 
-    r = requests.post(STORM_SEARCH_URL, json=query_params)
+    def get(self, watershed_name: str, transposition_region_ver: str, year, water_year_rank) -> dict:
+        """
+        Return the storm catalog hit of a historic storm, raising StormNotFoundError when there is none (and ValueError
+        when the search fails).
+        """
+        key = self.key(watershed_name, transposition_region_ver, year, water_year_rank)
+        with self._lock:
+            key_lock = self._key_locks[key]
+
+        # one search per key at a time, so concurrent lookups of the same storm wait for a single request
+        with key_lock:
+            if key in self._storms:
+                if not self._claim_prefetched(key):
+                    self._count("memory_hits")
+            elif not self._load(key):
+                self._store(self._search([key]))
+            hit = self._storms[key]
+
+        if hit is None:
+            raise StormNotFoundError(f"No storm found for {key}")
+        return hit
+
+    def prefetch(self, keys) -> None:
+        """Resolve many (watershed, region version, year, rank) keys with as few multi-search requests as possible."""
+        unresolved = []
+        for key in dict.fromkeys(self.key(*key) for key in keys):
+            if key in self._storms:
+                self._count("memory_hits")
+                self._mark_prefetched([key])
+            elif self._load(key):
+                self._mark_prefetched([key])
+            else:
+                unresolved.append(key)
+        for start in range(0, len(unresolved), self.batch_size):
+            hits = self._search(unresolved[start : start + self.batch_size])
+            self._store(hits)
+            self._mark_prefetched(hits)
+
+    def _mark_prefetched(self, keys):
+        with self._lock:
+            self._prefetched.update(keys)
+
+    def _claim_prefetched(self, key: tuple) -> bool:
+        """Whether key was resolved (and counted) by prefetch and not yet looked up since."""
+        with self._lock:
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                return True
+            return False
+
+    def _load(self, key: tuple) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT hit FROM storms WHERE watershed = ? AND region_version = ? AND year = ? AND rank = ?", key
+            ).fetchone()
+        if row is None:
+            return False
+        self._storms[key] = json.loads(row[0])
+        self._count("disk_hits")
+        return True
+
+    def _store(self, hits: dict):
+        self._storms.update(hits)
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO storms VALUES (?, ?, ?, ?, ?)",
+                [(*key, json.dumps(hit)) for key, hit in hits.items() if hit is not None],
+            )
+            self.conn.commit()
+
+    def _query(self, key: tuple) -> dict:
+        watershed_name, _, year, water_year_rank = key
+        return {
+            "filter": storm_search_filter(watershed_name, year, water_year_rank),
+            "sort": ["start.timestamp:asc"],
+            "limit": 1,
+        }
+
+    def _search(self, keys: list) -> dict:
+        """Search the storm catalog for keys, returning the first hit (or None) of each."""
+        self._count("remote_lookups", len(keys))
+        self._count("remote_requests")
+        queries = [{"indexUid": STORM_INDEX, **self._query(key)} for key in keys]
+        r = self.session.post(self.multi_search_url, json={"queries": queries})
+
+        if r.status_code in (404, 405, 501):
+            logging.warning(f"Storm multi-search unavailable ({r.status_code}), falling back to single searches")
+            self._count("remote_requests", len(keys))
+            results = []
+            for key in keys:
+                r = self.session.post(self.search_url, json=self._query(key))
+                _raise_for_status(r)
+                results.append(r.json())
+        else:
+            _raise_for_status(r)
+            results = r.json()["results"]
+
+        return {key: (result["hits"][0] if result["hits"] else None) for key, result in zip(keys, results)}
+
+    def _count(self, counter: str, n: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.remote_lookups
+        return {
+            "entries": len(self._storms),
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "remote_lookups": self.remote_lookups,
+            "remote_requests": self.remote_requests,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def _raise_for_status(r: requests.Response):
     try:
         r.raise_for_status()
     except Exception as e:
         raise ValueError(r.content.decode()) from e
-    data = json.loads(r.content)
 
-    if not data["hits"]:
-        raise ValueError("No storm found")
-    else:
-        return data["hits"][0]
+
+@lru_cache(maxsize=1)
+def get_storm_lookup() -> StormLookup:
+    """StormLookup shared by the harvest threads of the process (using STORM_CACHE_PATH)."""
+    return StormLookup()
+
+
+def storm_metadata(storm_data: dict, sst_storm_center: str) -> dict:
+    return {
+        "historic_storm_date": storm_data["start"]["datetime"],
+        "historic_storm_season": storm_data["start"]["season"],
+        "historic_storm_max_precip_inches": round(storm_data["stats"]["max"], 2),
+        "historic_storm_center": f'POINT({storm_data["geom"]["center_y"]} {storm_data["geom"]["center_x"]})',
+        "SST_storm_center": sst_storm_center,
+        f'{storm_data["start"]["datetime"].replace("-","")}.png': storm_data["metadata"]["png"],
+    }
 
 
-def storm_info_to_stac_metadata(client, s3_key, watershed_name: str = "Kanawha", transposition_region_ver: str = "V01"):
+def storm_info_to_stac_metadata(
+    client,
+    s3_key,
+    watershed_name: str = "Kanawha",
+    transposition_region_ver: str = "V01",
+    lookup: StormLookup = None,
+) -> dict:
+    """
+    Storm metadata of a .met file, {} when its storm is not in the storm catalog. Failures to read the file or to
+    search the catalog are raised.
+    """
+    lookup = lookup or get_storm_lookup()
+    sim_data = get_storm_info(s3_key, client)
+    storm_year = sim_data["storm_date"].split("-")[0]
+    storm_rank = sim_data["water_year_rank"]
+    # files without a storm center still get the historic storm metadata
+    sst_storm_center = sim_data.get("sst_storm_center")
     try:
-        sim_data = get_storm_info(s3_key, client)
-        storm_year = sim_data["storm_date"].split("-")[0]
-        storm_rank = sim_data["water_year_rank"]
-        sst_storm_center = sim_data["sst_storm_center"]
-    except Exception as e:
-        logging.error(e)
+        storm_data = lookup.get(watershed_name, transposition_region_ver, year=storm_year, water_year_rank=storm_rank)
+    except StormNotFoundError as e:
+        logging.warning(f"{s3_key}: {e}")
         return {}
-    try:
-        storm_data = storm_viewer_query(
-            watershed_name, transposition_region_ver, year=storm_year, water_year_rank=storm_rank
+    return storm_metadata(storm_data, sst_storm_center)
+
+
+def storms_to_stac_metadata(
+    client,
+    s3_keys: list,
+    watershed_name: str = "Kanawha",
+    transposition_region_ver: str = "V01",
+    lookup: StormLookup = None,
+) -> dict:
+    """
+    storm_info_to_stac_metadata for many .met files (e.g. those of the events harvested together by
+    new_collection.iter_event_items), read in parallel and resolving all their historic storms with batched searches.
+
+    Returns
+    -------
+        dict: The storm metadata of each s3 key, {} when its storm is not in the storm catalog and None when the file
+        could not be read or the catalog searched (logged).
+    """
+    lookup = lookup or get_storm_lookup()
+    storm_infos = read_storm_infos(client, s3_keys)
+
+    # reproject all the SST storm centers at once, files without a storm center are resolved with SST_storm_center=None
+    centered = [
+        s3_key
+        for s3_key, info in storm_infos.items()
+        if info.storm_center_x is not None and info.storm_center_y is not None
+    ]
+    sst_storm_centers = dict.fromkeys(storm_infos)
+    sst_storm_centers.update(
+        zip(
+            centered,
+            storm_center_points(
+                [storm_infos[s3_key].storm_center_x for s3_key in centered],
+                [storm_infos[s3_key].storm_center_y for s3_key in centered],
+            ),
         )
-        return {
-            "historic_storm_date": storm_data["start"]["datetime"],
-            "historic_storm_season": storm_data["start"]["season"],
-            "historic_storm_max_precip_inches": round(storm_data["stats"]["max"], 2),
-            "historic_storm_center": f'POINT({storm_data["geom"]["center_y"]} {storm_data["geom"]["center_x"]})',
-            "SST_storm_center": sst_storm_center,
-            f'{storm_data["start"]["datetime"].replace("-","")}.png': storm_data["metadata"]["png"],
-        }
+    )
+    sim_data = {
+        s3_key: (info.storm_date.split("-")[0], info.water_year_rank, sst_storm_centers[s3_key])
+        for s3_key, info in storm_infos.items()
+    }
 
+    try:
+        lookup.prefetch((watershed_name, transposition_region_ver, year, rank) for year, rank, _ in sim_data.values())
     except Exception as e:
-        logging.error(e)
-        return {}
+        # the storms left unresolved are searched one by one below
+        logging.error(f"Storm prefetch failed: {e}")
+
+    results = dict.fromkeys(s3_keys)
+    for s3_key, (year, rank, sst_storm_center) in sim_data.items():
+        try:
+            storm_data = lookup.get(watershed_name, transposition_region_ver, year=year, water_year_rank=rank)
+            results[s3_key] = storm_metadata(storm_data, sst_storm_center)
+        except StormNotFoundError as e:
+            logging.warning(f"{s3_key}: {e}")
+            results[s3_key] = {}
+        except Exception as e:
+            logging.error(f"{s3_key}: {e}")
+    return results
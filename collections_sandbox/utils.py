@@ -4,15 +4,17 @@
 
 import logging
 import os
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List
 from urllib.parse import quote
 
 import boto3
 import boto3.session
-import botocore
 import pystac
 import requests
-from mypy_boto3_s3.service_resource import ObjectSummary
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logging.getLogger("boto3").setLevel(logging.WARNING)
 logging.getLogger("botocore").setLevel(logging.WARNING)
@@ -25,18 +27,51 @@ def str_from_s3(ras_text_file_path: str, client, bucket) -> str:
     return response["Body"].read().decode("utf-8")
 
 
-def list_keys(s3_client: boto3.Session.client, bucket: str, prefix: str, suffix: str = "") -> list:
-    """List all keys in an S3 bucket with a given prefix and suffix."""
-    keys = []
+def list_objects(s3_client: boto3.Session.client, bucket: str, prefix: str, suffix: str = "") -> Iterator[dict]:
+    """
+    Yield the ListObjectsV2 summaries of all objects in an S3 bucket with a given prefix and suffix.
+
+    Each summary is the raw `Contents` entry (Key, Size, ETag, LastModified, StorageClass), so callers can build
+    asset metadata with `s3_metadata_from_listing` without a HEAD request per object.
+    """
     kwargs = {"Bucket": bucket, "Prefix": prefix}
     while True:
         resp = s3_client.list_objects_v2(**kwargs)
-        keys += [obj["Key"] for obj in resp["Contents"] if obj["Key"].endswith(suffix)]
+        for obj in resp.get("Contents", []):
+            if obj["Key"].endswith(suffix):
+                yield obj
         try:
             kwargs["ContinuationToken"] = resp["NextContinuationToken"]
         except KeyError:
             break
-    return keys
+
+
+def retry_with_backoff(
+    func: Callable, *args, retries: int = 3, backoff: float = 0.5, exceptions: tuple = (Exception,), **kwargs
+):
+    """
+    Call a function, retrying with exponential backoff when it raises one of the given exceptions.
+
+    Parameters
+    ----------
+        func (Callable): The function to call.
+        retries (int): The number of retries after the first attempt.
+        backoff (float): The delay in seconds before the first retry, doubled on each subsequent retry.
+        exceptions (tuple): The exception types that trigger a retry.
+
+    Returns
+    -------
+        The return value of func. The last exception is re-raised once retries are exhausted.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except exceptions as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            logging.warning(f"{func.__name__} failed ({e}), retrying in {delay:.2f}s ({attempt + 1}/{retries})")
+            time.sleep(delay)
 
 
 def init_s3_resources() -> tuple:
@@ -52,30 +87,27 @@ def init_s3_resources() -> tuple:
     return session, s3_client, s3_resource
 
 
-def get_basic_object_metadata(obj: ObjectSummary) -> dict:
+def s3_metadata_from_listing(obj: dict, region: str) -> dict:
     """
-    Retrieve basic metadata of an AWS S3 object.
+    Build the basic metadata of an AWS S3 object from its ListObjectsV2 object summary, without a HEAD request.
 
     Parameters
     ----------
-        obj (ObjectSummary): The AWS S3 object.
+        obj (dict): An object summary as yielded by `list_objects`.
+        region (str): The region of the bucket (not included in listings), e.g. `s3_client.meta.region_name`.
 
     Returns
     -------
         dict: A dictionary with the size, ETag, last modified date, storage platform, region, and storage tier of the object.
     """
-    try:
-        _ = obj.load()
-        return {
-            "file:size": obj.content_length,
-            "e_tag": obj.e_tag.strip('"'),
-            "last_modified": obj.last_modified.isoformat(),
-            "storage:platform": "AWS",
-            "storage:region": obj.meta.client.meta.region_name,
-            "storage:tier": obj.storage_class,
-        }
-    except botocore.exceptions.ClientError:
-        raise KeyError(f"Unable to access {obj.key} check that key exists and you have access")
+    return {
+        "file:size": obj["Size"],
+        "e_tag": obj["ETag"].strip('"'),
+        "last_modified": obj["LastModified"].isoformat(),
+        "storage:platform": "AWS",
+        "storage:region": region,
+        "storage:tier": obj.get("StorageClass"),
+    }
 
 
 def split_s3_key(s3_key: str) -> tuple[str, str]:
@@ -195,18 +227,233 @@ def upsert_collection(endpoint: str, collection: pystac.Collection, headers: dic
         raise RuntimeError(f"Error posting collection {(response.status_code)}")
 
 
-def upsert_item(endpoint: str, collection_id: str, item: pystac.Item, headers: dict):
-    """Upsert an item to a STAC API."""
+def init_http_session(pool_size: int = 16, retries: int = 3, backoff: float = 0.5) -> requests.Session:
+    """
+    Create a keep-alive requests session.
+
+    Connections are pooled (pool_size per host) and requests (of any method) are retried with exponential backoff on
+    429 and 5xx responses, honoring Retry-After.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def init_stac_session(pool_size: int = 16, retries: int = 3, backoff: float = 0.5) -> requests.Session:
+    """Create a keep-alive requests session for a STAC API (see init_http_session)."""
+    return init_http_session(pool_size=pool_size, retries=retries, backoff=backoff)
+
+
+def upsert_item(endpoint: str, collection_id: str, item: pystac.Item, headers: dict, session=requests) -> dict:
+    """
+    Upsert an item to a STAC API.
+
+    Returns
+    -------
+        dict: A result summary with the item id, the final HTTP status, the action taken ("created", "updated" or
+        "failed") and the error response text, if any.
+    """
     items_url = f"{endpoint}/collections/{collection_id}/items"
-    response = requests.post(items_url, json=item.to_dict(), headers=headers)
+    item_dict = item.to_dict()
+    response = session.post(items_url, json=item_dict, headers=headers)
+    action = "created"
 
     if response.status_code == 409:
         item_update_url = f"{items_url}/{item.id}"
-        response = requests.put(item_update_url, json=item.to_dict(), headers=headers)
-    elif response.status_code != 200:
-        return f"Response from STAC API: {response.status_code}"
+        response = session.put(item_update_url, json=item_dict, headers=headers)
+        action = "updated"
+
+    if not response.ok:
+        return {"id": item.id, "status": response.status_code, "action": "failed", "error": response.text}
+    return {"id": item.id, "status": response.status_code, "action": action, "error": None}
+
+
+def bulk_upsert_items(
+    endpoint: str,
+    collection_id: str,
+    items: List[pystac.Item],
+    headers: dict,
+    batch_size: int = 100,
+    max_workers: int = 8,
+    session: requests.Session = None,
+) -> List[dict]:
+    """
+    Upsert items to a STAC API in batches through the transactions `bulk_items` endpoint.
+
+    If the server does not support bulk transactions, items are upserted one by one (POST, then PUT on 409)
+    concurrently over a pooled session instead.
+
+    Parameters
+    ----------
+        endpoint (str): The STAC API root url.
+        collection_id (str): The collection the items belong to.
+        items (list): The items to upsert.
+        headers (dict): Headers sent with each request.
+        batch_size (int): The number of items sent per bulk request.
+        max_workers (int): The number of concurrent requests for the per-item fallback.
+        session (requests.Session): The session to use, defaults to `init_stac_session(max_workers)`.
+
+    Returns
+    -------
+        list: One result summary per item, see `upsert_item`.
+    """
+    session = session or init_stac_session(pool_size=max_workers)
+    bulk_url = f"{endpoint}/collections/{collection_id}/bulk_items"
+    results = []
+
+    for start in range(0, len(items), batch_size):
+        batch = items[start : start + batch_size]
+        payload = {"items": {item.id: item.to_dict() for item in batch}, "method": "upsert"}
+        response = session.post(bulk_url, json=payload, headers=headers)
+
+        if response.status_code in (404, 405, 501):
+            logging.info(f"bulk_items not supported by {endpoint} ({response.status_code}), upserting per item")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results += executor.map(
+                    lambda item: upsert_item(endpoint, collection_id, item, headers, session=session),
+                    items[start:],
+                )
+            break
+
+        if response.ok:
+            results += [
+                {"id": item.id, "status": response.status_code, "action": "upserted", "error": None} for item in batch
+            ]
+        else:
+            results += [
+                {"id": item.id, "status": response.status_code, "action": "failed", "error": response.text}
+                for item in batch
+            ]
+
+    failed = [result["id"] for result in results if result["action"] == "failed"]
+    if failed:
+        logging.error(f"Failed to upsert {len(failed)} of {len(items)} items: {failed}")
+    return results
+
+
+def search_items(endpoint: str, body: dict, session=requests) -> Iterator[dict]:
+    """Yield the items (as dicts) matching an item search, following the next links of each page (GET or POST)."""
+    url = f"{endpoint}/search"
+    method = "POST"
+    while url:
+        response = session.post(url, json=body) if method == "POST" else session.get(url)
+        response.raise_for_status()
+        page = response.json()
+        yield from page.get("features", [])
+
+        url = None
+        for link in page.get("links", []):
+            if link.get("rel") == "next":
+                url, method = link["href"], link.get("method", "GET").upper()
+                if method == "POST" and "body" in link:
+                    body = {**body, **link["body"]} if link.get("merge") else link["body"]
+
+
+def list_item_hashes(
+    endpoint: str, collection_id: str, hash_property: str, session=requests, page_size: int = 1000
+) -> dict:
+    """
+    Page through the items of a collection with the fields extension, transferring only the ids and content hashes.
+
+    Returns
+    -------
+        dict: {item id: content hash}, with None for items without the hash property (e.g. older items).
+    """
+    body = {
+        "collections": [collection_id],
+        "limit": page_size,
+        "fields": {
+            "include": ["id", f"properties.{hash_property}"],
+            "exclude": ["geometry", "bbox", "assets", "links"],
+        },
+    }
+    return {
+        feature["id"]: feature.get("properties", {}).get(hash_property)
+        for feature in search_items(endpoint, body, session=session)
+    }
+
+
+def put_item(endpoint: str, collection_id: str, item: pystac.Item, headers: dict, session=requests) -> dict:
+    """Update an existing item of a STAC API, creating it if it was removed since (see `upsert_item`)."""
+    response = session.put(
+        f"{endpoint}/collections/{collection_id}/items/{item.id}", json=item.to_dict(), headers=headers
+    )
+    if response.status_code == 404:
+        return upsert_item(endpoint, collection_id, item, headers, session=session)
     if not response.ok:
-        return f"Response from STAC API: {response.status_code}"
+        return {"id": item.id, "status": response.status_code, "action": "failed", "error": response.text}
+    return {"id": item.id, "status": response.status_code, "action": "updated", "error": None}
+
+
+def delete_item(endpoint: str, collection_id: str, item_id: str, headers: dict, session=requests) -> dict:
+    """Delete an item from a STAC API, returning a result summary (see `upsert_item`)."""
+    response = session.delete(f"{endpoint}/collections/{collection_id}/items/{item_id}", headers=headers)
+    if not response.ok and response.status_code != 404:
+        return {"id": item_id, "status": response.status_code, "action": "failed", "error": response.text}
+    return {"id": item_id, "status": response.status_code, "action": "deleted", "error": None}
+
+
+def sync_items(
+    endpoint: str,
+    collection_id: str,
+    items: List[pystac.Item],
+    remote_hashes: dict,
+    hash_property: str,
+    headers: dict,
+    max_workers: int = 8,
+    session: requests.Session = None,
+) -> List[dict]:
+    """
+    Push only the items that differ from a STAC API: POST the items missing from remote_hashes (see
+    `list_item_hashes`), PUT the items whose hash_property differs and skip the others.
+
+    Returns
+    -------
+        list: One result summary per item (see `upsert_item`), with the action "unchanged" for skipped items.
+    """
+    session = session or init_stac_session(pool_size=max_workers)
+
+    def sync(item):
+        if item.id not in remote_hashes:
+            return upsert_item(endpoint, collection_id, item, headers, session=session)
+        if remote_hashes[item.id] is None or remote_hashes[item.id] != item.properties.get(hash_property):
+            return put_item(endpoint, collection_id, item, headers, session=session)
+        return {"id": item.id, "status": None, "action": "unchanged", "error": None}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(sync, items))
+
+    failed = [result["id"] for result in results if result["action"] == "failed"]
+    if failed:
+        logging.error(f"Failed to sync {len(failed)} of {len(items)} items: {failed}")
+    return results
+
+
+def delete_items(
+    endpoint: str,
+    collection_id: str,
+    item_ids: List[str],
+    headers: dict,
+    max_workers: int = 8,
+    session: requests.Session = None,
+) -> List[dict]:
+    """Delete items from a STAC API concurrently, returning one result summary per item (see `delete_item`)."""
+    session = session or init_stac_session(pool_size=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                lambda item_id: delete_item(endpoint, collection_id, item_id, headers, session=session), item_ids
+            )
+        )
 
 
 def delete_collection(endpoint: str, collection_id: str, headers: dict):
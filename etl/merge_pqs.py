@@ -1,20 +1,42 @@
-import pandas as pd
+"""
+Move per-realization parquet files written before stac_to_pqs produced partitioned datasets into the
+`{data_name}/realization=N/` layout, one record batch at a time.
 
+New extractions should use `stac_to_pqs.py`, which writes the partitioned datasets directly.
+"""
 
-def combine_datasets(datasets, data_name):
-    df_list = [pd.read_parquet(file) for file in datasets]
-    df = pd.concat(df_list, ignore_index=True)
-    df.to_parquet(f"{data_name}-Kanawha-0505.pq")
+import os
+
+import pyarrow.parquet as pq
+
+
+def combine_datasets(datasets: dict, data_name: str, output_dir: str = "Kanawha-0505"):
+    for realization, file in datasets.items():
+        if not os.path.exists(file):
+            print(f"Skipping missing dataset {file}")
+            continue
+
+        partition_dir = os.path.join(output_dir, data_name, f"realization={realization}")
+        os.makedirs(partition_dir, exist_ok=True)
+
+        source = pq.ParquetFile(file)
+        schema = source.schema_arrow.remove_metadata()
+        if "realization" in schema.names:
+            schema = schema.remove(schema.get_field_index("realization"))
+
+        with pq.ParquetWriter(os.path.join(partition_dir, "part-0.parquet"), schema) as writer:
+            for batch in source.iter_batches(columns=schema.names):
+                writer.write_batch(batch)
 
 
 def main():
-    storm_datasets = [f"storms-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)]
+    storm_datasets = {r: f"storms-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)}
     combine_datasets(storm_datasets, "storms")
 
-    gage_datasets = [f"gages-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)]
+    gage_datasets = {r: f"gages-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)}
     combine_datasets(gage_datasets, "gages")
 
-    computation_datasets = [f"computation-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)]
+    computation_datasets = {r: f"computation-Kanawha-0505-R00{r}.parquet" for r in range(1, 6)}
     combine_datasets(computation_datasets, "computation")
 
 
@@ -1,37 +1,139 @@
+import argparse
+import json
 import os
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pystac_client import Client
 
+# the collection geoparquet layout is shared with the collections sandbox
+sys.path.append(str(Path(__file__).resolve().parents[1] / "collections_sandbox"))
+from collection_geoparquet import JSON_COLUMNS_KEY, NULL_PROPERTIES_COLUMN  # noqa: E402
+
 stac_url = os.getenv("STAC_API_URL")
 stac_client = Client.open(stac_url)
 stac_collections = ["None"] + [collection.id for collection in stac_client.get_collections()]
 collection_id = "Kanawha-0505-R001"
 item_data = []
 
+# Number of items extracted between parquet row group writes
+CHUNK_SIZE = int(os.getenv("ETL_CHUNK_SIZE", 100))
+
+# Rows per row group of tables rewritten by cluster_parquet, and rows it sorts in memory at a time
+CLUSTERED_ROW_GROUP_SIZE = 20_000
+CLUSTER_MAX_ROWS = int(os.getenv("ETL_CLUSTER_MAX_ROWS", 1_000_000))
+
+STORM_SCHEMA = pa.schema(
+    [
+        ("ID", pa.string()),
+        ("event", pa.int64()),
+        ("block_group", pa.int64()),
+        ("realization", pa.int64()),
+        ("SST_storm_center", pa.string()),
+        ("historic_storm_date", pa.string()),
+        ("historic_storm_center", pa.string()),
+        ("historic_storm_season", pa.string()),
+        ("historic_storm_max_precip_inches", pa.float64()),
+        ("SST_storm_center_lat", pa.float64()),
+        ("SST_storm_center_lon", pa.float64()),
+        ("historic_storm_center_lat", pa.float64()),
+        ("historic_storm_center_lon", pa.float64()),
+    ]
+)
+
+GAGE_SCHEMA = pa.schema(
+    [
+        ("max_flow_time", pa.string()),
+        ("max_flow_value", pa.float64()),
+        ("max_wse_time", pa.string()),
+        ("max_wse_value", pa.float64()),
+        ("primary_key", pa.int64()),
+        ("ras_model", pa.string()),
+        ("realization", pa.int64()),
+        ("event", pa.int64()),
+        ("block_group", pa.int64()),
+        ("ID", pa.string()),
+        ("gage", pa.string()),
+    ]
+)
+
+COMPUTATION_SCHEMA = pa.schema(
+    [
+        ("excess_precip_inches", pa.float64()),
+        ("volume_error_pct", pa.float64()),
+        ("computation_time_minutes", pa.float64()),
+        ("primary_key", pa.int64()),
+        ("realization", pa.int64()),
+        ("event", pa.int64()),
+        ("block_group", pa.int64()),
+        ("ID", pa.string()),
+        ("ras_model", pa.string()),
+    ]
+)
+
+TABLE_SCHEMAS = {"storms": STORM_SCHEMA, "gages": GAGE_SCHEMA, "computation": COMPUTATION_SCHEMA}
+
+# Parquet sidecar holding the gage summaries of compact items (see collections_sandbox/new_collection.compact_item)
+GAGE_SUMMARY_ASSET = "gage-summary"
+
+# Columns the extraction reads from the collection geoparquet files written by
+# collections_sandbox/collection_geoparquet.py (assets only for the gages table)
+GEOPARQUET_COLUMNS = [
+    "id",
+    "assets",
+    NULL_PROPERTIES_COLUMN,
+    "FFRD:event",
+    "FFRD:block_group",
+    "FFRD:realization",
+    "FFRD:SST_storm_center",
+    "FFRD:historic_storm_date",
+    "FFRD:historic_storm_center",
+    "FFRD:historic_storm_season",
+    "FFRD:historic_storm_max_precip_inches",
+    "HEC_RAS:model_summary",
+]
+
+# Hive partitioning of the datasets written by write_dataset
+PARTITIONING = ds.partitioning(pa.schema([("realization", pa.int64())]), flavor="hive")
+
 
 def storms_data_to_df(data):
     return pd.DataFrame(data)
 
 
-def extract_computation_data(item, counter=0):
-    computation_data = {}
-    for k, data in item.properties["HEC_RAS:model_summary"].items():
-        data["primary_key"] = counter
-        data["realization"] = item.properties["FFRD:realization"]
-        data["event"] = item.properties["FFRD:event"]
-        data["block_group"] = item.properties["FFRD:block_group"]
-        data["ID"] = item.id
-        data["ras_model"] = k
-        computation_data[counter] = data
-        counter += 1
-    return computation_data
+def extract_computation_data(item) -> list:
+    """Computation rows of an item, one per RAS model, built without modifying the item properties."""
+    keys = {
+        "realization": item.properties["FFRD:realization"],
+        "event": item.properties["FFRD:event"],
+        "block_group": item.properties["FFRD:block_group"],
+        "ID": item.id,
+    }
+    return [{**data, **keys, "ras_model": k} for k, data in item.properties["HEC_RAS:model_summary"].items()]
+
+
+# Storm centers written by storm_info as "POINT(lat lon)"
+POINT_PATTERN = r"^\s*POINT\((?P<lat>-?\d+(?:\.\d*)?)\s+(?P<lon>-?\d+(?:\.\d*)?)\)\s*$"
+
+
+def point_to_lat_lon(point: str) -> tuple:
+    """Parse a storm center written by storm_info as "POINT(lat lon)", returning (None, None) if unavailable."""
+    try:
+        lat, lon = point.strip()[len("POINT(") : -1].split()
+        return float(lat), float(lon)
+    except (AttributeError, ValueError):
+        return None, None
 
 
 def extract_storm_data(item):
-    return {
+    storm_data = {
         "ID": item.id,
         "event": item.properties.get("FFRD:event", "N/A"),
         "block_group": item.properties.get("FFRD:block_group", "N/A"),
@@ -42,80 +144,420 @@ def extract_storm_data(item):
         "historic_storm_season": item.properties.get("FFRD:historic_storm_season", "N/A"),
         "historic_storm_max_precip_inches": item.properties.get("FFRD:historic_storm_max_precip_inches", "N/A"),
     }
+    for center in ("SST_storm_center", "historic_storm_center"):
+        storm_data[f"{center}_lat"], storm_data[f"{center}_lon"] = point_to_lat_lon(storm_data[center])
+    return storm_data
+
+
+def reference_summary_rows(summary: dict):
+    """
+    (gage, data) pairs of an HDF asset reference summary, stored either nested by mesh or columnar (see
+    model_info.sanitize_reference_summary_data).
+    """
+    if isinstance(summary.get("gage"), list):
+        fields = [field for field in summary if field not in ("mesh_name", "gage")]
+        for gage, *values in zip(summary["gage"], *(summary[field] for field in fields)):
+            yield gage, dict(zip(fields, values))
+        return
+    for gages in summary.values():
+        yield from gages.items()
 
 
-def extract_gage_data(item, counter=0):
-    gage_data = {}
+def extract_gage_data(item) -> list:
+    """
+    Gage rows of an item, one per reference line of each RAS model, built without modifying the asset fields.
+
+    Read from the gage summary sidecar of compact items, otherwise from the reference summaries of the HDF assets.
+    """
+    keys = {
+        "realization": item.properties["FFRD:realization"],
+        "event": item.properties["FFRD:event"],
+        "block_group": item.properties["FFRD:block_group"],
+        "ID": item.id,
+    }
+    if GAGE_SUMMARY_ASSET in item.assets:
+        return gage_summary_rows(item.assets[GAGE_SUMMARY_ASSET].href, keys)
+
+    rows = []
     for a in item.get_assets(role="ras-simulation"):
         asset = item.assets[a]
         summary = asset.extra_fields.get("hec_ras:reference_summary_output", "N/A")
-        for mesh_name, gages in summary.items():
-            for gage, data in gages.items():
-                data["primary_key"] = counter
-                data["ras_model"] = Path(asset.href).name[:-8]
-                data["realization"] = item.properties["FFRD:realization"]
-                data["event"] = item.properties["FFRD:event"]
-                data["block_group"] = item.properties["FFRD:block_group"]
-                data["ID"] = item.id
-                data["gage"] = gage
-                gage_data[counter] = data
-                counter += 1
-    return gage_data
-
-
-def main(collection_id: str):
-    storm_data = []
-    gage_data, gage_data_counter = {}, 0
-    computation_data, computation_data_counter = {}, 0
+        rows.extend(reference_summary_gage_rows(asset.href, summary, keys))
+    return rows
+
+
+def gage_summary_rows(href: str, keys: dict) -> list:
+    """Gage rows of a gage summary sidecar (see collections_sandbox/new_collection.compact_item)."""
+    return [{**row, **keys} for row in pq.read_table(href).to_pylist()]
+
+
+def reference_summary_gage_rows(href: str, summary: dict, keys: dict) -> list:
+    """Gage rows of the reference summary of the HDF asset at href."""
+    ras_model = Path(href).name[:-8]
+    return [{**data, **keys, "ras_model": ras_model, "gage": gage} for gage, data in reference_summary_rows(summary)]
+
+
+def extract_asset_gage_data(assets: dict, keys: dict) -> list:
+    """extract_gage_data for the assets of an item as dicts (e.g. decoded from a collection geoparquet file)."""
+    if GAGE_SUMMARY_ASSET in assets:
+        return gage_summary_rows(assets[GAGE_SUMMARY_ASSET]["href"], keys)
+
+    rows = []
+    for asset in assets.values():
+        if "ras-simulation" in asset.get("roles", []):
+            summary = asset.get("hec_ras:reference_summary_output", "N/A")
+            rows.extend(reference_summary_gage_rows(asset["href"], summary, keys))
+    return rows
+
+
+class TableBuilder:
+    """
+    Typed column buffers of one summary table, extended with the rows extracted from each item.
+
+    Rows are numbered with a primary_key (when the schema has one) from a counter that only increases, also across
+    flushes, so keys stay unique over all the chunks of a collection.
+    """
+
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+        self.columns = {field.name: [] for field in schema}
+        self.next_key = 0
+
+    def extend(self, rows: list):
+        """Append rows (dicts) to the column buffers, ignoring keys not in the schema."""
+        for row in rows:
+            if "primary_key" in self.columns:
+                row = {**row, "primary_key": self.next_key}
+                self.next_key += 1
+            for name, column in self.columns.items():
+                column.append(row.get(name))
+
+    def to_table(self) -> pa.Table:
+        """Arrow table of the buffered rows, treating "N/A" in non-string columns as null."""
+        arrays = []
+        for field in self.schema:
+            values = self.columns[field.name]
+            if not pa.types.is_string(field.type):
+                values = [None if v == "N/A" else v for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
 
+    def flush(self) -> pa.Table:
+        """Arrow table of the buffered rows, emptying the buffers (the primary key keeps counting)."""
+        table = self.to_table()
+        for column in self.columns.values():
+            column.clear()
+        return table
+
+
+# Rows extracted from an item for each table
+EXTRACTORS = {
+    "storms": lambda item: [extract_storm_data(item)],
+    "gages": extract_gage_data,
+    "computation": extract_computation_data,
+}
+
+
+def geoparquet_column(batch: pa.RecordBatch, name: str, type: pa.DataType, json_columns: set) -> pa.Array:
+    """A property column of a collection geoparquet batch as type (nulls when no item has the property)."""
+    if name not in batch.schema.names:
+        return pa.nulls(batch.num_rows, type)
+    column = batch.column(name)
+    if name in json_columns:
+        column = pa.array([None if value is None else json.loads(value) for value in column.to_pylist()], type)
+    return column.cast(type)
+
+
+def geoparquet_storm_table(batch: pa.RecordBatch, schema: pa.Schema, json_columns: set) -> pa.Table:
+    """
+    The storms table of a collection geoparquet batch, projected from its columns (see extract_storm_data: string
+    properties an item lacks are "N/A", those it sets to null stay null).
+    """
+    null_properties = [
+        set(names or ())
+        for names in (
+            batch.column(NULL_PROPERTIES_COLUMN).to_pylist()
+            if NULL_PROPERTIES_COLUMN in batch.schema.names
+            else [None] * batch.num_rows
+        )
+    ]
+
+    def storm_column(name: str, type: pa.DataType) -> pa.Array:
+        column = geoparquet_column(batch, f"FFRD:{name}", type, json_columns)
+        if not pa.types.is_string(type):
+            return column
+        missing = pa.array([f"FFRD:{name}" not in names for names in null_properties], pa.bool_())
+        return pc.if_else(pc.and_(pc.is_null(column), missing), "N/A", column)
+
+    centers = {}
+    for center in ("SST_storm_center", "historic_storm_center"):
+        points = pc.extract_regex(storm_column(center, pa.string()), POINT_PATTERN)
+        # struct_field (unlike StructArray.field) keeps the nulls of the points that did not match
+        centers[f"{center}_lat"] = pc.struct_field(points, "lat").cast(pa.float64())
+        centers[f"{center}_lon"] = pc.struct_field(points, "lon").cast(pa.float64())
+
+    arrays = []
+    for field in schema:
+        if field.name in centers:
+            arrays.append(centers[field.name])
+        elif field.name == "ID":
+            arrays.append(batch.column("id"))
+        else:
+            arrays.append(storm_column(field.name, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def iter_geoparquet_chunks(path: str, chunk_size: int = CHUNK_SIZE, schemas: dict = None):
+    """
+    The extracted tables ({table name: arrow table}) of a collection geoparquet file (see
+    collections_sandbox/collection_geoparquet.py), every chunk_size items, like iter_item_chunks.
+
+    The tables are projected from the columns of the file instead of rebuilding the items: the storms table is cast
+    from the storm columns, the computation table decodes the model summaries and only the gages table reads and
+    decodes the assets (which hold the reference summaries of every gage).
+    """
+    schemas = schemas or TABLE_SCHEMAS
+    parquet = pq.ParquetFile(path)
+    json_columns = set(json.loads(parquet.schema_arrow.metadata.get(JSON_COLUMNS_KEY, b"[]")))
+    columns = [
+        column
+        for column in GEOPARQUET_COLUMNS
+        if column in parquet.schema_arrow.names and (column != "assets" or "gages" in schemas)
+    ]
+    builders = {name: TableBuilder(schema) for name, schema in schemas.items() if name != "storms"}
+
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+        print(f"{batch.num_rows} items from {path}")
+        tables = {}
+        if "storms" in schemas:
+            tables["storms"] = geoparquet_storm_table(batch, schemas["storms"], json_columns)
+
+        keys = [
+            {"realization": realization, "event": event, "block_group": block_group, "ID": item_id}
+            for realization, event, block_group, item_id in zip(
+                *(
+                    geoparquet_column(batch, f"FFRD:{name}", pa.int64(), json_columns).to_pylist()
+                    for name in ("realization", "event", "block_group")
+                ),
+                batch.column("id").to_pylist(),
+            )
+        ]
+        if "computation" in builders:
+            summaries = geoparquet_column(batch, "HEC_RAS:model_summary", pa.string(), set()).to_pylist()
+            for item_keys, summary in zip(keys, summaries):
+                try:
+                    builders["computation"].extend(
+                        [{**data, **item_keys, "ras_model": k} for k, data in json.loads(summary).items()]
+                    )
+                except Exception as e:
+                    print(f"Error extracting computation data: {e}")
+        if "gages" in builders:
+            for item_keys, assets in zip(keys, batch.column("assets").to_pylist()):
+                try:
+                    builders["gages"].extend(extract_asset_gage_data(json.loads(assets), item_keys))
+                except Exception as e:
+                    print(f"Error extracting gages data: {e}")
+
+        tables.update((name, builder.flush()) for name, builder in builders.items())
+        yield {name: tables[name] for name in schemas}
+
+
+def iter_item_chunks(collection_id: str, chunk_size: int = CHUNK_SIZE, schemas: dict = None, geoparquet: str = None):
+    """
+    Page through the items of a collection, yielding the extracted tables ({table name: arrow table}) every chunk_size
+    items so the caller only ever holds one chunk in memory.
+
+    schemas defaults to TABLE_SCHEMAS; columns left out of a schema are not kept. With geoparquet, the items are read
+    from that export of the collection instead of the STAC API.
+    """
+    if geoparquet is not None:
+        yield from iter_geoparquet_chunks(geoparquet, chunk_size, schemas)
+        return
+
+    builders = {name: TableBuilder(schema) for name, schema in (schemas or TABLE_SCHEMAS).items()}
+    items = 0
     for i, item in enumerate(stac_client.get_collection(collection_id).get_all_items()):
         print(i, item.id)
-        try:
-            storm_data.append(extract_storm_data(item))
-        except Exception as e:
-            print(f"Error extracting storm data: {e}")
+        for name, builder in builders.items():
+            try:
+                builder.extend(EXTRACTORS[name](item))
+            except Exception as e:
+                print(f"Error extracting {name} data: {e}")
 
-        try:
-            gage_data.update(extract_gage_data(item, counter=gage_data_counter))
-        except Exception as e:
-            print(f"Error extracting gage data: {e}")
+        items += 1
+        if items == chunk_size:
+            yield {name: builder.flush() for name, builder in builders.items()}
+            items = 0
 
-        try:
-            computation_data.update(extract_computation_data(item, counter=computation_data_counter))
-        except Exception as e:
-            print(f"Error extracting computation data: {e}")
+    if items:
+        yield {name: builder.flush() for name, builder in builders.items()}
 
-        try:
-            computation_data_counter = max(computation_data.keys())
-        except ValueError:
-            print("No computation data found")
 
-        try:
-            gage_data_counter = max(gage_data.keys())
-        except ValueError:
-            print("No gage data found")
+def main(collection_id: str, geoparquet: str = None) -> dict:
+    """Extract the summary tables of a collection (or of its geoparquet export), {table name: DataFrame}."""
+    chunks = {name: [schema.empty_table()] for name, schema in TABLE_SCHEMAS.items()}
+    for tables in iter_item_chunks(collection_id, geoparquet=geoparquet):
+        for name, table in tables.items():
+            chunks[name].append(table)
+    return {name: pa.concat_tables(tables).to_pandas() for name, tables in chunks.items()}
 
-        # if i == 30:
-        #     break
 
-    return storm_data, gage_data, computation_data
+def write_parquet(
+    collection_id: str,
+    paths: dict = None,
+    chunk_size: int = CHUNK_SIZE,
+    drop_columns: tuple = (),
+    geoparquet: str = None,
+):
+    """
+    Stream the summary tables of a collection to parquet, appending one row group per chunk of items.
 
+    Peak memory is bounded by chunk_size rather than the size of the collection. paths maps each table name in
+    TABLE_SCHEMAS to its output file (defaults to `{table}-{collection_id}.parquet`), and drop_columns are left out of
+    the files (e.g. hive partition columns). With geoparquet, the items are read from that export of the collection.
+    """
+    paths = paths or {name: f"{name}-{collection_id}.parquet" for name in TABLE_SCHEMAS}
+    schemas = {}
+    for name, schema in TABLE_SCHEMAS.items():
+        for column in drop_columns:
+            schema = schema.remove(schema.get_field_index(column))
+        schemas[name] = schema
 
-if __name__ == "__main__":
-    args = sys.argv[1:]
-    if len(args) == 1:
-        realization = args[0]
-    else:
-        print("please enter realization (1-5) for Kanawha")
+    writers = {name: pq.ParquetWriter(paths[name], schema) for name, schema in schemas.items()}
+    try:
+        for tables in iter_item_chunks(collection_id, chunk_size, schemas, geoparquet):
+            for name, table in tables.items():
+                writers[name].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # the viewer reads one gage at a time, cluster by gage so row group statistics prune the rest
+    cluster_parquet(paths["gages"], sort_by=[("gage", "ascending"), ("event", "ascending")])
+
+
+def cluster_ranges(path: str, column: str, max_rows: int, descending: bool = False) -> list:
+    """
+    Split the values of a column of a parquet file into consecutive (low, high) ranges of about max_rows rows (a value
+    with more rows is a range of its own), counting the rows of each value a record batch at a time. Rows where the
+    column is null are the (None, None) range, last.
+    """
+    counts = {}
+    for batch in pq.ParquetFile(path).iter_batches(columns=[column]):
+        value_counts = pc.value_counts(batch.column(0))
+        for value, count in zip(value_counts.field("values").to_pylist(), value_counts.field("counts").to_pylist()):
+            counts[value] = counts.get(value, 0) + count
+
+    ranges, low, rows = [], None, 0
+    values = sorted((value for value in counts if value is not None), reverse=descending)
+    for value in values:
+        if rows and rows + counts[value] > max_rows:
+            ranges.append((low, previous))
+            low, rows = None, 0
+        if low is None:
+            low = value
+        rows += counts[value]
+        previous = value
+    if rows:
+        ranges.append((low, previous))
+    if None in counts:
+        ranges.append((None, None))
+    return ranges
+
+
+def cluster_parquet(
+    path: str, sort_by: list, row_group_size: int = CLUSTERED_ROW_GROUP_SIZE, max_rows: int = CLUSTER_MAX_ROWS
+):
+    """
+    Rewrite a parquet file sorted by the sort_by columns, so that the min/max statistics of each row group cover a
+    narrow range of values and filters on those columns only read the matching row groups.
+
+    The file is sorted in bounded memory, like write_parquet: its rows are split into ranges of the first sort column
+    of about max_rows rows (see cluster_ranges), and each range is read (scanning the file with a filter), sorted and
+    appended to the new file in turn. The file is replaced once it is fully written.
+    """
+    column, order = sort_by[0]
+    directory, name = os.path.split(path)
+    # hidden from dataset discovery while it is written
+    clustered_path = os.path.join(directory, f".{name}.clustering")
+    dataset = ds.dataset(path)
+    with pq.ParquetWriter(clustered_path, dataset.schema) as writer:
+        for low, high in cluster_ranges(path, column, max_rows, descending=order == "descending"):
+            if low is None:
+                expression = pc.field(column).is_null()
+            else:
+                low, high = min(low, high), max(low, high)
+                expression = (pc.field(column) >= low) & (pc.field(column) <= high)
+            writer.write_table(dataset.to_table(filter=expression).sort_by(sort_by), row_group_size=row_group_size)
+    os.replace(clustered_path, path)
 
-    collection_id = f"Kanawha-0505-R00{realization}"
-    storm_data, gage_data, computation_data = main(collection_id)
 
-    storms_df = storms_data_to_df(storm_data)
-    storms_df.to_parquet(f"storms-{collection_id}.parquet", engine="pyarrow")
+def partition_path(output_dir: str, table: str, realization: int) -> str:
+    return os.path.join(output_dir, table, f"realization={realization}")
 
-    gages_df = pd.DataFrame.from_records(gage_data).T
-    gages_df.to_parquet(f"gages-{collection_id}.parquet", engine="pyarrow")
 
-    computation_df = pd.DataFrame.from_records(computation_data).T
-    computation_df.to_parquet(f"computation-{collection_id}.parquet", engine="pyarrow")
+def write_realization(
+    realization: int, output_dir: str, chunk_size: int = CHUNK_SIZE, geoparquet_dir: str = None
+) -> str:
+    """
+    Extract one realization into the `realization=N/` hive partition of each table under output_dir, from the STAC
+    API or from its `{geoparquet_dir}/{collection_id}.parquet` export.
+    """
+    collection_id = f"Kanawha-0505-R{realization:03}"
+    paths = {}
+    for name in TABLE_SCHEMAS:
+        partition_dir = partition_path(output_dir, name, realization)
+        os.makedirs(partition_dir, exist_ok=True)
+        paths[name] = os.path.join(partition_dir, "part-0.parquet")
+    geoparquet = os.path.join(geoparquet_dir, f"{collection_id}.parquet") if geoparquet_dir else None
+    write_parquet(collection_id, paths, chunk_size, drop_columns=("realization",), geoparquet=geoparquet)
+    return collection_id
+
+
+def write_dataset(
+    realizations: list,
+    output_dir: str,
+    max_workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+    geoparquet_dir: str = None,
+):
+    """
+    Extract several realizations concurrently (one process per collection) into hive-partitioned parquet datasets,
+    `{output_dir}/{storms,gages,computation}/realization=N/`, read back with `partitioning=PARTITIONING`.
+
+    The partitions of a realization that fails are removed, so readers never see a partly written realization, and a
+    RuntimeError listing the failed realizations is raised once the others are done.
+    """
+    failed = {}
+    with ProcessPoolExecutor(max_workers=max_workers or len(realizations)) as executor:
+        futures = {
+            executor.submit(write_realization, realization, output_dir, chunk_size, geoparquet_dir): realization
+            for realization in realizations
+        }
+        for future in as_completed(futures):
+            realization = futures[future]
+            try:
+                print(f"Finished {future.result()}")
+            except Exception as e:
+                print(f"Error extracting realization {realization}: {e}")
+                failed[realization] = e
+                for name in TABLE_SCHEMAS:
+                    shutil.rmtree(partition_path(output_dir, name, realization), ignore_errors=True)
+
+    if failed:
+        raise RuntimeError(f"Failed to extract realizations {sorted(failed)}: {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract Kanawha realizations into partitioned parquet datasets.")
+    parser.add_argument("realizations", nargs="*", type=int, default=[1, 2, 3, 4, 5], help="realizations (1-5)")
+    parser.add_argument("--output", default="Kanawha-0505", help="root directory of the partitioned datasets")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument(
+        "--geoparquet",
+        default=None,
+        help="directory of collection geoparquet exports ({collection_id}.parquet) read instead of the STAC API",
+    )
+    args = parser.parse_args()
+
+    write_dataset(args.realizations, args.output, max_workers=args.workers, geoparquet_dir=args.geoparquet)